@@ -4,7 +4,7 @@ Database Search Assistant Main App
 """
 
 import streamlit as st
-from src.config import indexed_data
+from src.data_service import get_data_service
 
 st.title("Database Search Assistant 🔬")
 chat_page = st.Page("pages/page_chat.py", title="Chat", icon="💬")
@@ -16,13 +16,15 @@ pg.run()
 with st.sidebar:
 
     st.header("Database Stats 📊")
-    total = len(indexed_data)
-    human_count = sum(1 for s in indexed_data if s.get('organism', '').lower() == 'human')
-    mouse_count = sum(1 for s in indexed_data if s.get('organism', '').lower() == 'mouse')
+    data = get_data_service()
+    total = len(data.studies)
+    human_count = data.organism_counts.get('human', 0)
+    mouse_count = data.organism_counts.get('mouse', 0)
     col1, col2, col3 = st.columns(3)
     col1.metric("Human", human_count)
     col2.metric("Mouse", mouse_count)
     col3.metric("Total", total)
+    st.caption(f"Shared data in memory: {data.memory_report()['total'] / 1e6:.0f} MB (all sessions)")
     st.divider()
 
     st.header("Examples 🔎")
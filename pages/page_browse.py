@@ -3,14 +3,21 @@
 Database Search Assistant - Browse Page
 """
 
+import os
+from functools import partial
 import streamlit as st
 import pandas as pd
 import datetime
-from src.config import indexed_data, url_df, df_csv
+from src.data_service import get_data_service, BROWSE_COLUMNS
+from src.pagination import paginate, update_selection
+from src.jobs import get_job_manager, current_owner, ACTIVE_STATUSES
+from src.export import FORMATS, available_formats
+from src.facets import FACET_KEYS, FACET_LABELS
 
 # Page Setup
 st.set_page_config(page_title="Browse | Database Search Assistant", page_icon="🖥", layout="wide")
-current_time = datetime.datetime.now()
+data = get_data_service()
+registry = data.registry
 st.header("All Studies 📑")
 
 # Initialize selected studies in session state
@@ -30,31 +37,61 @@ with col3:
     search_text = st.text_input("Search (project/title/disease/gene/drugs)", key="search_text", help= " Use commas to separate terms")
 
 # Filter data
-filtered_data = indexed_data.copy()
-
-if organism_filter != "All":
-    filtered_data = [s for s in filtered_data if s.get('organism', '').lower() == organism_filter.lower()]
-if min_samples > 0:
-    filtered_data = [s for s in filtered_data if s.get('n_samples', 0) >= min_samples]
-if search_text:
-    search_terms = [t.strip() for t in search_text.split(',')]
-    # If all terms look like project IDs, return exact matches
-    project_prefixes = ('SRP', 'GSE', 'PRJNA', 'ERP', 'DRP')
-    if all(t.upper().startswith(project_prefixes) for t in search_terms):
-        search_upper = [t.upper() for t in search_terms]
-        filtered_data = [s for s in filtered_data if s.get('project', '').upper() in search_upper]
-    else:
-        filtered_data = [s for s in filtered_data if
-                         all(t.lower() in s.get('study_title', '').lower() or
-                             t.upper() in s.get('project', '').upper() or
-                             t.lower() in ' '.join(s.get('diseases', [])).lower() or
-                             t.lower() in ' '.join(s.get('tissues', [])).lower() or
-                             t.lower() in ' '.join(s.get('drugs', [])).lower() or
-                             t.lower() in ' '.join(s.get('genes', [])).lower() or
-                             t.lower() in ' '.join(s.get('techniques', [])).lower()
-                             for t in search_terms)]
-
-st.markdown(f"**Showing {len(filtered_data)} studies**")
+PROJECT_PREFIXES = ('SRP', 'GSE', 'PRJNA', 'ERP', 'DRP')
+FACET_OPTIONS = 100  # Values listed per facet, most frequent first (chosen values are always listed)
+JOB_POLL_SECONDS = 2  # Refresh interval of the downloads panel while a job runs
+JOB_IDLE_POLL_SECONDS = 15  # Refresh interval otherwise, to pick up jobs submitted from another tab
+
+def filter_mask(frame: pd.DataFrame, organism: str, min_samples: int, search_text: str) -> pd.Series:
+    """Boolean mask of the studies matching the filters (all vectorized)."""
+    mask = pd.Series(True, index=frame.index)
+    if organism != "All":
+        mask &= frame['_organism'] == organism.lower()
+    if min_samples > 0:
+        mask &= frame['Samples'] >= min_samples
+    if search_text:
+        search_terms = [t.strip() for t in search_text.split(',')]
+        # If all terms look like project IDs, return exact matches
+        if all(t.upper().startswith(PROJECT_PREFIXES) for t in search_terms):
+            mask &= frame['_project'].isin([t.upper() for t in search_terms])
+        else:
+            # Every term must occur in the title, project ID or one of the entity fields
+            for t in search_terms:
+                mask &= frame['_search'].str.contains(t.lower(), regex=False)
+    return mask
+
+def update_facet(key: str):
+    st.session_state.facet_selection[key] = st.session_state[f"facet_{key}"]
+
+# Facets: each facet's counts are within the filters above and the choices in the other facets
+if 'facet_selection' not in st.session_state:
+    st.session_state.facet_selection = {key: [] for key in FACET_KEYS}
+facet_selection = st.session_state.facet_selection
+
+browse_frame = data.browse_frame
+facets = data.facets
+base_mask = facets.from_bools(filter_mask(browse_frame, organism_filter, min_samples, search_text).to_numpy())
+
+with st.sidebar:
+    st.header("Facets")
+    for key in FACET_KEYS:
+        counts = facets.counts(key, base_mask & facets.selection_mask(facet_selection, skip=key), limit=FACET_OPTIONS)
+        chosen = facet_selection[key]
+        # The labels carry the counts, so the widget is re-created when they change; `default` keeps the choices
+        st.multiselect(
+            FACET_LABELS[key],
+            list(counts) + [v for v in chosen if v not in counts],
+            default=chosen,
+            format_func=lambda v, counts=counts: f"{v} ({counts.get(v, 0)})",
+            key=f"facet_{key}",
+            on_change=update_facet,
+            args=(key,)
+        )
+
+filtered = browse_frame.loc[facets.to_bools(base_mask & facets.selection_mask(facet_selection)), BROWSE_COLUMNS]
+filtered_projects = filtered['Project'].tolist()
+
+st.markdown(f"**Showing {len(filtered)} studies**")
 
 # Function to clear all filters
 def clear_all_selection():
@@ -69,13 +106,17 @@ def clear_all_filters():
     st.session_state.organism_filter = "All"
     st.session_state.min_samples = 0
     st.session_state.search_text = ""
+    st.session_state.facet_selection = {key: [] for key in FACET_KEYS}
+    for key in FACET_KEYS:
+        st.session_state.pop(f"facet_{key}", None)
 
 # Selection/Clear Buttons
 col_select1, col_select2, col_select3 = st.columns([1,6,0.5], gap="medium")
 
 with col_select1:
     if st.button("Select All"):
-        st.session_state.selected_studies = [s['project'] for s in filtered_data]
+        st.session_state.selected_studies = filtered_projects
+        st.session_state.selector_version += 1
 
 with col_select2:
     if st.button("Clear Selection", on_click = clear_all_selection):
@@ -85,23 +126,11 @@ with col_select3:
     if st.button("Clear All Filters", on_click = clear_all_filters):
         pass
 
-# Df with selection
-df_data = []
-for s in filtered_data:
-    df_data.append({
-        'Select': s['project'] in st.session_state.selected_studies,
-        'Project': s.get('project', ''),
-        'Title': s.get('study_title', ''),
-        'Organism': s.get('organism', ''),
-        'Samples': s.get('n_samples', 0),
-        'Diseases': ', '.join(s.get('diseases', [])),
-        'Tissue': ', '.join(s.get('tissues', [])),
-        'Drugs': ', '.join(s.get('drugs', [])),
-        'Genes': ', '.join(s.get('genes', [])),
-        'Techniques': ', '.join(s.get('techniques', [])),
-    })
-
-df = pd.DataFrame(df_data)
+# Df with selection (current page only)
+page_df, page_state = paginate(filtered, "browse", reset_on=(organism_filter, min_samples, search_text,
+                                                       *(tuple(facet_selection[key]) for key in FACET_KEYS)))
+df = page_df.copy()
+df.insert(0, 'Select', df['Project'].isin(st.session_state.selected_studies))
 
 edited_df = st.data_editor(
     df,
@@ -118,14 +147,17 @@ edited_df = st.data_editor(
     hide_index=True,
     width='stretch',
     height=500,
-    key=f"study_selector_{st.session_state.selector_version}"
+    key=f"study_selector_{st.session_state.selector_version}_{page_state}"
 )
 
-# Update selected studies to session state
-if not df.empty and 'Select' in df.columns:
-    selected_studies = edited_df[edited_df['Select'] == True]['Project'].tolist()
-else:
-    selected_studies = []
+# Update selected studies to session state (selections on other pages are kept)
+if not df.empty:
+    st.session_state.selected_studies = update_selection(
+        st.session_state.selected_studies,
+        df['Project'].tolist(),
+        edited_df[edited_df['Select'] == True]['Project'].tolist()
+    )
+selected_studies = st.session_state.selected_studies
 
 
 # Study Selection and Download
@@ -138,16 +170,16 @@ st.subheader(f":green-background[***Selected: {num_selected} studies***]")
 @st.dialog("Abstracts 📄", width="large")
 def show_abstracts_popup(selected_studies):
     for project in selected_studies:
-        row = df_csv[df_csv['project'] == project]
-        if not row.empty:
-            title = row['study_title'].values[0] if 'study_title' in row.columns else proj
-            abstract = row['study_abstract'].values[0]
+        record = registry.abstract(project)
+        if record is not None:
+            title = record['study_title'] or project
             with st.expander(f"**{project}** | {title}"):
-                st.markdown(abstract)
+                st.markdown(record['study_abstract'])
 
 # For selected studies
 if num_selected > 0:
-    st.write(", ".join(selected_studies))
+    shown = ", ".join(selected_studies[:100])
+    st.write(shown + (f", ... (+{num_selected - 100} more)" if num_selected > 100 else ""))
 
     # Warning for large selections
     if num_selected > 10:
@@ -157,133 +189,137 @@ if num_selected > 0:
     if st.button("View Abstracts 📄", type="secondary"):
         show_abstracts_popup(selected_studies)
 
-    # Export selected studies as CSV
-    if selected_studies:
-        export_df = df[df['Project'].isin(selected_studies)].drop(columns=['Select'])
-        csv = export_df.to_csv(index=False)
-        st.download_button(
-            label=f"Export selected studies as CSV 📥 ",
-            data=csv,
-            file_name=f"studyinfo_{current_time}.csv",
-            mime="text/csv"
-        )
-    else:
-        st.info("Select studies to export as CSV")
-
-    # Prepare ZIP file for download
+    # Queue the raw files as a background job; it keeps running across reruns and page switches
     if st.button("Get Raw Files and Metadata 🧬", type="secondary"):
-
-        import zipfile
-        import requests
-        from io import BytesIO
-
-        # Get URLs and raw files
-        if url_df is None:
+        if not registry.has_urls:
             st.error("recount3_raw_and_metadata_url.csv not found.")
             st.stop()
-
-        url_columns = [
-            'raw_gene', 'raw_exon', 'raw_jxn_MM', 'raw_jxn_RR', 'raw_jxn_ID',
-            'project_meta', 'recount_project', 'recount_qc', 'recount_seq_qc', 'recount_pred'
-        ]
-
-        # Create zips in memory
-        raw_zip_buffer = BytesIO()
-        urls_zip_buffer = BytesIO()
-
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-
-        st.session_state.selected_studies = selected_studies
-        total = len(st.session_state.selected_studies)
-        failed_downloads = []
-
-        with zipfile.ZipFile(raw_zip_buffer, 'w', zipfile.ZIP_DEFLATED) as raw_zip, \
-             zipfile.ZipFile(urls_zip_buffer, 'w', zipfile.ZIP_DEFLATED) as urls_zip:
-
-            for i, project_id in enumerate(st.session_state.selected_studies):
-                status_text.text(f"Fetching {project_id}... ({i + 1}/{total})")
-                progress_bar.progress((i + 1) / total)
-
-                # Get URLs for this project
-                row = url_df[url_df['project'] == project_id]
-                if row.empty:
-                    failed_downloads.append(project_id)
-                    continue
-
-                # Get study title for URL txt filename
-                study_match = [s for s in indexed_data if s.get('project') == project_id]
-                if study_match:
-                    project_name = study_match[0].get('project', project_id)
-                    safe_title = "".join(c for c in project_name if c.isalnum() or c in (' ', '-', '_'))[:50]
-                    txt_filename = f"{safe_title}.txt"
-                else:
-                    txt_filename = f"{project_id}.txt"
-
-                # Collect URLs for txt file
-                url_lines = [f"# {project_id}"]
-
-                # Download each URL
-                for col in url_columns:
-                    if col not in row.columns:
-                        continue
-
-                    url = row[col].values[0]
-                    if pd.isna(url) or not str(url).startswith('http'):
-                        continue
-
-                    # Add to URL list
-                    url_lines.append(url)
-
-                    try:
-                        response = requests.get(url, timeout=60)
-                        response.raise_for_status()
-                        filename = url.split('/')[-1] if '/' in url else f"{col}.txt"
-                        zip_path = f"{project_id}/{filename}"
-                        raw_zip.writestr(zip_path, response.content)
-
-                    except Exception as e:
-                        print(f"Failed to download {col} for {project_id}: {e}")
-
-                # Write URL txt file
-                urls_zip.writestr(txt_filename, "\n".join(url_lines))
-
-        progress_bar.empty()
-        status_text.empty()
-
-        raw_zip_buffer.seek(0)
-        urls_zip_buffer.seek(0)
-
-        successful = total - len(failed_downloads)
-
-        if successful > 0:
-            st.success(f"{successful} datasets ready for download ⬇️")
-
-            col1, col2 = st.columns([1, 8])
-
-            with col1:
-                st.download_button(
-                    label="Download Raw Files \n(local) 🗂️",
-                    data=raw_zip_buffer.getvalue(),
-                    file_name=f"raw_{current_time}.zip",
-                    mime="application/zip",
-                    type="primary",
-                    on_click="ignore"
-                )
-            with col2:
-                st.download_button(
-                    label="Download URLs as TXT 🔗",
-                    data=urls_zip_buffer.getvalue(),
-                    file_name=f"urls_{current_time}.zip",
-                    mime="application/zip",
-                    on_click = "ignore"
-                )
-
-        if failed_downloads:
-            st.warning(f"⚠️ Could not find data for {len(failed_downloads)} studies")
-            with st.expander("Show failed"):
-                for proj in failed_downloads:
-                    st.write(f"• {proj}")
+        get_job_manager().submit(current_owner(), selected_studies)
+        st.success("Download queued ⏳ You can keep browsing or come back later; it is listed below.")
 
 else:
-    st.info("Select studies to view abstracts or enable download.")
\ No newline at end of file
+    st.info("Select studies to view abstracts or enable download.")
+
+# Export selected or filtered studies as a background job, streamed from the study store to a file
+with st.expander("Export study metadata 📥"):
+    col1, col2, col3 = st.columns([2, 1, 2])
+    with col1:
+        scope_labels = {"selected": f"Selected studies ({num_selected})",
+                        "filtered": f"All filtered studies ({len(filtered)})"}
+        scope = st.radio("Studies", list(scope_labels), index=0 if num_selected else 1,
+                         format_func=scope_labels.get, key="export_scope")
+    with col2:
+        export_format = st.radio("Format", available_formats(), key="export_format")
+    with col3:
+        with_abstracts = st.checkbox("Include abstracts", key="export_abstracts")
+        with_urls = st.checkbox("Include recount3 URLs", key="export_urls")
+
+    export_projects = selected_studies if scope == "selected" else filtered_projects
+    if st.button(f"Export {len(export_projects)} studies as {export_format} 📥", disabled=not export_projects,
+                 key="export_submit"):
+        get_job_manager().submit_export(current_owner(), export_projects, export_format, with_abstracts, with_urls)
+        st.success("Export queued ⏳ It is listed below when it is ready.")
+
+
+# Spool files are read from disk only when clicked; those too large to hold in memory are shown by path
+def file_download_button(label: str, path: str, file_name: str, mime: str = "application/zip", **kwargs):
+    from src.downloader import format_bytes, read_file, servable
+
+    if servable(path):
+        st.download_button(label=label, data=partial(read_file, path), file_name=file_name, mime=mime,
+                           on_click="ignore", **kwargs)
+    else:
+        st.caption(f"{file_name} is {format_bytes(os.path.getsize(path))}, too large to download through "
+                   f"the browser. Copy it from the server:")
+        st.code(path, language=None)
+
+
+# Download jobs of this browser, polled while any of them is still running
+def show_download_jobs(polling_active: bool = False):
+    from src.downloader import format_bytes
+
+    manager = get_job_manager()
+    jobs = manager.jobs_for(current_owner())
+    exports = manager.exports_for(current_owner())
+    if any(item['status'] in ACTIVE_STATUSES for item in jobs + exports) != polling_active:
+        st.rerun()  # run_every is fixed per full run: rerun the app to switch poll interval
+    if not jobs and not exports:
+        return
+    st.divider()
+    st.subheader("Downloads 🧬")
+    cache = manager.cache_stats()
+    st.caption(f"Download cache: {cache['entries']} files, {format_bytes(cache['total_bytes'])}, "
+               f"{cache['hit_rate']:.0%} of requested files served locally")
+
+    for export in exports:
+        submitted = datetime.datetime.fromtimestamp(export['created'])
+        with st.container(border=True):
+            st.markdown(f"**Export of {len(export['projects'])} studies as {export['format']}** · "
+                        f"{export['status']} · submitted {submitted.strftime('%Y-%m-%d %H:%M')}")
+            if export['status'] in ACTIVE_STATUSES:
+                continue
+            col1, col2 = st.columns([2, 6])
+            if export['status'] == 'done' and os.path.exists(export['path']):
+                extension, mime = FORMATS[export['format']]
+                with col1:
+                    file_download_button("Download export 📥", export['path'], f"studyinfo_{submitted}.{extension}",
+                                         mime=mime, type="primary", key=f"export_{export['id']}")
+            with col2:
+                st.button("Remove", key=f"remove_export_{export['id']}", on_click=manager.remove_export,
+                          args=(export['id'],))
+            if export['error']:
+                st.warning(f"⚠️ Export failed: {export['error']}")
+    for job in jobs:
+        submitted = datetime.datetime.fromtimestamp(job['created']).strftime('%Y-%m-%d %H:%M')
+        with st.container(border=True):
+            st.markdown(f"**{len(job['projects'])} studies, {job['files_total']} files** · "
+                        f"{job['status']} · submitted {submitted}")
+
+            if job['status'] in ACTIVE_STATUSES:
+                # Bytes only when every size is known, so the bar does not jump back as sizes turn up
+                if job.get('sizes_known') and job['bytes_total']:
+                    fraction = job['bytes_done'] / job['bytes_total']
+                else:
+                    fraction = job['files_done'] / job['files_total'] if job['files_total'] else 0
+                st.progress(min(fraction, 1.0))
+                lines = [f"{job['files_done']}/{job['files_total']} files, "
+                         f"{format_bytes(job['bytes_done'])} / {format_bytes(job['bytes_total'])}"]
+                lines += [f"  {project}/{name}: {format_bytes(done)}" + (f" / {format_bytes(size)}" if size else "")
+                          for project, name, done, size in job.get('active', [])[:8]]
+                st.text("\n".join(lines))
+                st.button("Cancel", key=f"cancel_{job['id']}", on_click=manager.cancel, args=(job['id'],))
+                continue
+
+            col1, col2, col3 = st.columns([1, 1, 6])
+            if job['files_done'] > job['failed'] and os.path.exists(job['archive']):
+                with col1:
+                    file_download_button("Download Raw Files \n(local) 🗂️", job['archive'], f"raw_{job['id']}.zip",
+                                         key=f"raw_{job['id']}", type="primary")
+            if os.path.exists(job['urls_archive']):
+                with col2:
+                    file_download_button("Download URLs as TXT 🔗", job['urls_archive'], f"urls_{job['id']}.zip",
+                                         key=f"urls_{job['id']}")
+            with col3:
+                st.button("Remove", key=f"remove_{job['id']}", on_click=manager.remove, args=(job['id'],))
+
+            cached = [row for row in job['report'] if row['Status'] == 'cached']
+            if cached:
+                st.caption(f"{len(cached)}/{job['files_total']} files served from the local cache "
+                           f"({format_bytes(sum(row['Bytes'] for row in cached))})")
+            if job['failed']:
+                st.warning(f"⚠️ {job['failed']} files could not be downloaded. Select the studies and start "
+                           f"the download again to fetch only what is missing: finished files come from the "
+                           f"cache and partial files resume where they stopped.")
+            if job['failed'] or any(row['Status'] == 'resumed' for row in job['report']):
+                with st.expander("Show file status"):
+                    st.dataframe(job['report'], hide_index=True)
+            if job['missing']:
+                st.warning(f"⚠️ Could not find data for {len(job['missing'])} studies")
+                with st.expander("Show failed"):
+                    for proj in job['missing']:
+                        st.write(f"• {proj}")
+
+
+manager, owner = get_job_manager(), current_owner()
+jobs_running = any(item['status'] in ACTIVE_STATUSES for item in manager.jobs_for(owner) + manager.exports_for(owner))
+st.fragment(show_download_jobs, run_every=JOB_POLL_SECONDS if jobs_running else JOB_IDLE_POLL_SECONDS)(jobs_running)
@@ -6,8 +6,9 @@ Database Search Assistant - Chat Page
 import streamlit as st
 import pandas as pd
 import ollama 
-from src.config import indexed_data, df_csv
-from src.intent import detect_intent, check_ambiguity, handle_clarification
+from src.data_service import get_data_service
+from src.pagination import paginate, update_selection
+from src.intent import classify_intent, log_intent, check_ambiguity, handle_clarification
 from src.search import search_data
 from src.analyze import analyze
 from src.parser import parse_search_query
@@ -16,6 +17,8 @@ from src.utils import set_llm_model
 
 # Page Setup
 st.set_page_config(page_title="Chat | Database Search Assistant", page_icon="💬", layout="wide")
+data = get_data_service()
+registry = data.registry
 st.header("What do you want to find? 💬")
 
 # Helper function to discover local ollama models
@@ -64,7 +67,7 @@ model = st.selectbox("Model (Qwen2.5:7b Recommended)", options=available_models,
 set_llm_model(model)
 
 
-st.caption(f"Searching through {len(indexed_data)} gene expression studies")
+st.caption(f"Searching through {len(data.studies)} gene expression studies")
 
 # Chat state
 if 'messages' not in st.session_state:
@@ -80,10 +83,14 @@ if 'awaiting_clarification' not in st.session_state:
 # For download from df display
 if 'chat_selector_version' not in st.session_state:
     st.session_state.chat_selector_version = 0
+if 'selected_studies' not in st.session_state:
+    st.session_state.selected_studies = []
 
-def display_results(results: list):
+RESULT_COLUMNS = ['Project', 'Title', 'Organism', 'Samples', 'Diseases', 'Tissue', 'Genes', 'Drugs', 'Techniques']
+
+def display_results(results: list, key: str):
     """
-    Display results to user
+    Display results to user, one page at a time
     """
     if not results:
         st.warning("No studies found.")
@@ -91,19 +98,9 @@ def display_results(results: list):
 
     st.success(f"Found {len(results)} studies")
 
-    df = pd.DataFrame([{
-        'Project': s.get('project', ''),
-        'Title': s.get('study_title', ''),
-        'Organism': s.get('organism', ''),
-        'Samples': s.get('n_samples', 0),
-        'Diseases': ', '.join(s.get('diseases', [])),
-        'Tissue': ', '.join(s.get('tissues', [])),
-        'Genes': ', '.join(s.get('genes', [])),
-        'Drugs': ', '.join(s.get('drugs', [])),
-        'Techniques': ', '.join(s.get('techniques', [])),
-    } for s in results])
-
-    st.dataframe(df, width='stretch', height=400, hide_index=True)
+    df = pd.DataFrame([data.display_rows[s['project']] for s in results], columns=RESULT_COLUMNS)
+    page_df, _ = paginate(df, key, default_size=25)
+    st.dataframe(page_df, width='stretch', height=400, hide_index=True)
 
 # Keywords for analyze function
 ANALYZE_KEYWORDS = [
@@ -112,8 +109,6 @@ ANALYZE_KEYWORDS = [
     'what genes', 'what techniques', 'what diseases', 'what cells'
 ]
 
-PROJECT_IDS = {s.get('project', '').upper() for s in indexed_data}
-
 def process_input(user_input: str):
     """
     Process user input - handles queries and clarification responses.
@@ -135,22 +130,19 @@ def process_input(user_input: str):
             return "message", "I didn't quite understand. Let's start over.", None
 
     # Check for project ID first
-    user_upper = user_input.upper().strip()
-    if user_upper in PROJECT_IDS:
-        matches = [s for s in indexed_data if s.get('project', '').upper() == user_upper]
-        if matches:
-            return "project", matches[0], None
-        else:
-            return "message", f"Project '{user_input}' not found.", None
+    study = registry.study(user_input)
+    if study is not None:
+        return "project", study, None
 
     # Detect intent - check keywords before LLM
     query_lower = user_input.lower()
     if any(trigger in query_lower for trigger in ANALYZE_KEYWORDS):
+        log_intent(user_input, 'analyze', 'keyword')
         answer = analyze(user_input)
         return "message", answer, None
 
-    # Fall back to LLM intent detection
-    intent = detect_intent(user_input)
+    # Local classifier, falls back to LLM intent detection when unsure
+    intent = classify_intent(user_input)
     if intent.get('intent') == 'analyze':
         answer = analyze(user_input)
         return "message", answer, None
@@ -209,14 +201,14 @@ with chat_container:
             if msg["type"] == "text":
                 st.markdown(msg["content"])
             elif msg["type"] == "results":
-                display_results(msg["content"])
+                display_results(msg["content"], key=f"results_{i}")
             elif msg["type"] == "project":
                 s = msg["content"]
                 st.markdown(f"### {s['project']} | {s['study_title']}")
-                # Display abstract from original csv
-                row = df_csv[df_csv['project'] == s['project']]
-                if not row.empty:
-                    abstract = row['study_abstract'].values[0]
+                # Display abstract from the abstract store
+                record = registry.abstract(s['project'])
+                abstract = record['study_abstract'] if record else None
+                if abstract is not None:
                     st.caption(f"ABSTRACT")
                     st.markdown(f"{abstract}")
 
@@ -239,6 +231,7 @@ with chat_container:
                 # Download button
                 if st.button("View & Download in Browse Page →", key=f"browse_{s['project']}_{i}", type="primary"):
                         st.session_state.selected_studies = [s['project']]
+                        st.session_state.selector_version = st.session_state.get('selector_version', 0) + 1
                         st.switch_page("pages/page_browse.py")
 # Chat Input
 if prompt := st.chat_input("Ask me anything..."):
@@ -287,32 +280,39 @@ if 'last_results' in st.session_state and st.session_state.last_results:
     st.divider()
     st.markdown(f"**Select studies to view abstract/download:**")
 
-    df_data = [{
-        'Select': s['project'] in st.session_state.get('selected_studies', []),
-        'Project': s.get('project', ''),
-        'Title': s.get('study_title', ''),
-        'Organism': s.get('organism', ''),
-        'Samples': s.get('n_samples', 0),
-        'Diseases': ', '.join(s.get('diseases', [])),
-        'Tissue': ', '.join(s.get('tissues', [])),
-        'Genes': ', '.join(s.get('genes', [])),
-        'Drugs': ', '.join(s.get('drugs', [])),
-        'Techniques': ', '.join(s.get('techniques', [])),
-    } for s in results]
-
-    df = pd.DataFrame(df_data)
+    result_projects = [s['project'] for s in results]
+    col1, col2 = st.columns([1, 8])
+    with col1:
+        if st.button("Select All", key="chat_select_all"):
+            st.session_state.selected_studies = result_projects
+            st.session_state.chat_selector_version += 1
+    with col2:
+        if st.button("Clear Selection", key="chat_clear_selection"):
+            st.session_state.selected_studies = []
+            st.session_state.chat_selector_version += 1
+
+    all_df = pd.DataFrame([data.display_rows[p] for p in result_projects], columns=RESULT_COLUMNS)
+    page_df, page_state = paginate(all_df, "chat_results", reset_on=tuple(result_projects))
+    df = page_df.copy()
+    df.insert(0, 'Select', df['Project'].isin(st.session_state.selected_studies))
     edited_df = st.data_editor(
         df,
         column_config={"Select": st.column_config.CheckboxColumn("Select", default=False)},
         disabled=["Project", "Title", "Organism", "Samples", "Diseases", "Tissue", "Genes", "Drugs", "Techniques"],
         hide_index=True,
         height=400,
-        key=f"chat_selector_{st.session_state.chat_selector_version}"
+        key=f"chat_selector_{st.session_state.chat_selector_version}_{page_state}"
     )
 
-    selected = edited_df[edited_df['Select'] == True]['Project'].tolist()
+    # Selections on other pages are kept
+    st.session_state.selected_studies = update_selection(
+        st.session_state.selected_studies,
+        df['Project'].tolist(),
+        edited_df[edited_df['Select'] == True]['Project'].tolist()
+    )
+    selected = st.session_state.selected_studies
     if selected:
         st.success(f"{len(selected)} studies selected")
         if st.button("View & Download in Browse Page →", type="primary"):
-            st.session_state.selected_studies = selected  # only set on button click
+            st.session_state.selector_version = st.session_state.get('selector_version', 0) + 1
             st.switch_page("pages/page_browse.py")
\ No newline at end of file
@@ -0,0 +1,186 @@
+# abstract_store.py
+"""
+On-disk abstract store keyed by project ID.
+
+Each study's title and abstract are compressed with zlib as one record (the
+codec is recorded in the index). Only the project -> (offset, length)
+index is held in memory; records are read from an mmap on demand and the most
+recently used ones are kept decoded in a small LRU.
+
+Layout:
+    8 bytes   magic b'R3ABST\\0\\0'
+    uint32    format version
+    uint32    reserved
+    uint64    index offset
+    uint64    index length
+    ...       compressed records
+    ...       JSON index: codec, source stamp, {project: [offset, length]}
+
+Build with:
+    python -m src.abstract_store
+The app also builds it on first use when it is missing or stale. Every build
+writes its own temporary file and renames it into place, so concurrent
+sessions never read or write a half-built store.
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+MAGIC = b'R3ABST\0\0'
+FORMAT_VERSION = 1
+PREFIX = struct.Struct('<8sIIQQ')
+CACHE_SIZE = 256  # Decoded abstracts kept in memory
+ENCODING = 'utf-8'
+
+CODECS = {'zlib': (lambda b: zlib.compress(b, 9), zlib.decompress)}
+DEFAULT_CODEC = 'zlib'
+
+
+def _stamp(path: str) -> list:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_abstract_store(csv_path: str, path: str, codec: str = DEFAULT_CODEC) -> int:
+    """Write the store from the original CSV (project, study_title, study_abstract)."""
+    import pandas as pd
+
+    compress = CODECS[codec][0]
+    df = pd.read_csv(csv_path, encoding=ENCODING, usecols=['project', 'study_title', 'study_abstract'])
+    df = df.astype(object).where(df.notna(), None)
+
+    index = {}
+    # A unique temporary file per build, so concurrent builds cannot interleave
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix='.tmp',
+                                    dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _write_records(f, df, index, compress, codec, csv_path)
+        os.chmod(tmp_path, 0o644)  # mkstemp creates owner-only files
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return len(index)
+
+
+def _write_records(f, df, index: dict, compress, codec: str, csv_path: str) -> None:
+    f.write(b'\0' * PREFIX.size)
+    for project, title, abstract in zip(df['project'], df['study_title'], df['study_abstract']):
+        if project is None or str(project) in index:
+            continue
+        data = compress(json.dumps([title, abstract], ensure_ascii=False).encode(ENCODING))
+        index[str(project)] = [f.tell(), len(data)]
+        f.write(data)
+
+    index_bytes = json.dumps({'codec': codec, 'source': _stamp(csv_path), 'records': index}).encode(ENCODING)
+    index_offset = f.tell()
+    f.write(index_bytes)
+    f.seek(0)
+    f.write(PREFIX.pack(MAGIC, FORMAT_VERSION, 0, index_offset, len(index_bytes)))
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class AbstractStore:
+    """Read-only abstract lookups by project ID."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, index_offset, index_len = PREFIX.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} abstract store")
+        header = json.loads(self._mm[index_offset:index_offset + index_len])
+        if header['codec'] not in CODECS:
+            self._mm.close()
+            raise ValueError(f"{path} uses codec {header['codec']}, which is not available")
+
+        self.codec = header['codec']
+        self.source = header['source']
+        self._decompress = CODECS[self.codec][1]
+        self._index = {project: tuple(loc) for project, loc in header['records'].items()}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, project):
+        return project in self._index
+
+    def get(self, project: str):
+        """Return {'study_title', 'study_abstract'} for a project, or None."""
+        with self._lock:
+            record = self._cache.get(project)
+            if record is not None:
+                self._cache.move_to_end(project)
+                return record
+
+        loc = self._index.get(project)
+        if loc is None:
+            return None
+        offset, length = loc
+        title, abstract = json.loads(self._decompress(self._mm[offset:offset + length]))
+        record = {'study_title': title, 'study_abstract': abstract}
+
+        with self._lock:
+            self._cache[project] = record
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return record
+
+    def abstract(self, project: str):
+        """Return only the abstract text of a project, or None."""
+        record = self.get(project)
+        return record['study_abstract'] if record else None
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+def open_abstract_store(path: str, csv_path: str = None):
+    """
+    Open the store, (re)building it first when it is missing or older than
+    the CSV. Returns None if neither is available.
+    """
+    store = None
+    if os.path.exists(path):
+        try:
+            store = AbstractStore(path)
+        except (ValueError, OSError, struct.error) as e:
+            print(f"Ignoring abstract store {path}: {e}")
+
+    csv_exists = csv_path is not None and os.path.exists(csv_path)
+    if store is not None and (not csv_exists or store.source == _stamp(csv_path)):
+        return store
+    if store is not None:
+        store.close()
+    if not csv_exists:
+        print("Warning: no abstract store or full_dataset.csv found.")
+        return None
+
+    print(f"Building abstract store {path}...")
+    try:
+        count = build_abstract_store(csv_path, path)
+    except OSError as e:
+        print(f"Warning: could not build abstract store: {e}")
+        return None
+    print(f"Stored {count} abstracts")
+    return AbstractStore(path)
+
+
+if __name__ == "__main__":
+    from src.config import ABSTRACTS_FILE, ORIGINAL_CSV
+
+    count = build_abstract_store(ORIGINAL_CSV, ABSTRACTS_FILE)
+    print(f"Wrote {count} abstracts to {ABSTRACTS_FILE} ({os.path.getsize(ABSTRACTS_FILE) / 1e6:.1f} MB)")
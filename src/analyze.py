@@ -4,7 +4,7 @@ LLM for analyze queries.
 """
 
 from collections import Counter
-from src.config import indexed_data
+from src.data_service import get_data_service
 from src.parser import parse_analyze_query
 from src.utils import call_llm
 from src.query_standardizer import standardize_search
@@ -37,7 +37,7 @@ def analyze(user_query: str):
     target_drug = parsed.get('drugs')
     organism = parsed.get('organism')
 
-    data_to_analyze = indexed_data
+    data_to_analyze = get_data_service().studies
 
     # Check if this is a counting query
     query_lower = user_query.lower()
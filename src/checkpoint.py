@@ -0,0 +1,151 @@
+# checkpoint.py
+"""
+Append-only JSONL checkpoints for the offline extraction and mapping jobs.
+
+Each record is one JSON line. Lines are flushed and fsynced every
+`fsync_every` appends, so a crash loses at most one batch and can only leave
+a partial last line, which is dropped on reopen. Record keys are mirrored to a
+small `.ids` file so a resume only needs the keys, not the records. Records
+with an "error" field are kept but not indexed, so a resume retries them.
+A record with `"_deleted": true` is a tombstone for its key.
+"""
+
+import json
+import os
+
+ENCODING = 'utf-8'
+
+
+def atomic_write_json(path: str, data, indent: int = None) -> None:
+    """Write JSON to a temp file and rename it over path."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding=ENCODING) as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class JsonlCheckpoint:
+    """Append-only JSONL checkpoint keyed by one record field."""
+
+    def __init__(self, path: str, key: str = 'project', fsync_every: int = 10):
+        self.path = path
+        self.ids_path = f"{path}.ids"
+        self.key = key
+        self.fsync_every = fsync_every
+        self._file = None
+        self._ids_file = None
+        self._unsynced = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _repair(self, path: str) -> None:
+        """Drop a partially written last line left by a crash."""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            # Scan back to the last complete line
+            pos = size - 1
+            while pos > 0:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                chunk = f.read(step)
+                newline = chunk.rfind(b'\n')
+                if newline != -1:
+                    pos = pos - step + newline + 1
+                    break
+                pos -= step
+            f.truncate(max(pos, 0))
+
+    def ids(self) -> set:
+        """Keys of all records without an error (from the .ids index if present)."""
+        if os.path.exists(self.ids_path):
+            with open(self.ids_path, 'r', encoding=ENCODING) as f:
+                return {line.rstrip('\n') for line in f if line.endswith('\n')}
+        return {str(key) for key, record in self.latest().items() if 'error' not in record}
+
+    def records(self) -> list:
+        """Read all records in append order, skipping unreadable lines."""
+        records = []
+        if not self.exists():
+            return records
+        with open(self.path, 'r', encoding=ENCODING) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    def latest(self) -> dict:
+        """Last record per key (later appends win)."""
+        return {record.get(self.key): record for record in self.records()}
+
+    def open(self) -> "JsonlCheckpoint":
+        if self._file is None:
+            self._repair(self.path)
+            self._repair(self.ids_path)
+            if self.exists() and not os.path.exists(self.ids_path):
+                # Rebuild the resume index for checkpoints written without one
+                keys = self.ids()  # Read before the index file exists, or it would read as empty
+                with open(self.ids_path, 'w', encoding=ENCODING) as f:
+                    f.writelines(f"{key}\n" for key in keys)
+            self._file = open(self.path, 'a', encoding=ENCODING)
+            self._ids_file = open(self.ids_path, 'a', encoding=ENCODING)
+        return self
+
+    def append(self, record: dict) -> None:
+        """Append one record; fsync every `fsync_every` appends."""
+        self.open()
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        if 'error' not in record:
+            self._ids_file.write(f"{record.get(self.key)}\n")
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """Flush and fsync records before their keys, so the index never runs ahead."""
+        if self._file is None or self._unsynced == 0:
+            return
+        for f in (self._file, self._ids_file):
+            f.flush()
+            os.fsync(f.fileno())
+        self._unsynced = 0
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._ids_file.close()
+        self._file = self._ids_file = None
+
+    def compact(self, output_path: str, indent: int = 2) -> list:
+        """Write the de-duplicated records (last write wins, tombstones dropped) as one JSON list."""
+        self.close()
+        records = [r for r in self.latest().values() if not r.get('_deleted')]
+        atomic_write_json(output_path, records, indent=indent)
+        return records
+
+    def remove(self) -> None:
+        """Delete the checkpoint and its index."""
+        self.close()
+        for path in (self.path, self.ids_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
@@ -4,7 +4,6 @@ Configuration settings and data loading.
 """
 
 import json
-import pandas as pd
 import os
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -14,33 +13,95 @@ INDEXED_FILE = os.path.join(BASE_DIR, 'data', 'mapped_parsed_data_final.json')
 ORIGINAL_CSV = os.path.join(BASE_DIR, 'data', 'full_dataset.csv')
 MAPPINGS_FILE = os.path.join(BASE_DIR, 'data', 'standardization_mappings_final.json')
 DATA_URL_FILE = os.path.join(BASE_DIR, 'data', 'recount3_raw_and_metadata_url.csv')
+INTENT_LOG_FILE = os.path.join(BASE_DIR, 'data', 'intent_log.jsonl')
 ENCODING = 'utf-8'
 
-def load_data():
+SNAPSHOT_FILE = os.path.join(BASE_DIR, 'data', 'snapshot.bin')
+ABSTRACTS_FILE = os.path.join(BASE_DIR, 'data', 'abstracts.bin')
+DOWNLOAD_CACHE_DIR = os.path.join(BASE_DIR, 'data', 'download_cache')
+JOBS_DIR = os.path.join(BASE_DIR, 'data', 'jobs')
+
+_snapshot = None
+_loaded = {}
+
+
+def get_snapshot():
+    """The binary snapshot, opened on first use (None if missing or stale)."""
+    global _snapshot
+    if _snapshot is None:
+        from src.snapshot import open_snapshot
+        _snapshot = open_snapshot(SNAPSHOT_FILE) or False
+    return _snapshot or None
+
+
+def load_data(use_snapshot: bool = True):
+    snapshot = get_snapshot() if use_snapshot else None
+    if snapshot is not None:
+        return snapshot.table('studies')
+
     with open(INDEXED_FILE, 'r', encoding=ENCODING) as f:
         data = json.load(f)
 
     # Only keep studies if study_title is a non-empty string
     return [s for s in data if isinstance(s.get('study_title'), str) and s['study_title'].strip()]
 
-# Load mapped json
-indexed_data = load_data()
-
-# Load csv
-df_csv = pd.read_csv(ORIGINAL_CSV, encoding= ENCODING)
-
-# Load mappings json
-try:
-    with open(MAPPINGS_FILE, 'r', encoding=ENCODING) as f:
-        MAPPINGS = json.load(f)
-    print(f"Loaded standardization mappings")
-except FileNotFoundError:
-    MAPPINGS = {}
-    print("No standardization mappings found - using LLM only")
-
-# Load URL data
-try:
-    url_df = pd.read_csv(DATA_URL_FILE)
-except FileNotFoundError:
-    url_df = None
-    print("Warning: recount3_raw_and_metadata_url.csv not found.")
+
+def load_csv():
+    import pandas as pd
+    return pd.read_csv(ORIGINAL_CSV, encoding=ENCODING)
+
+
+def load_abstracts():
+    from src.abstract_store import open_abstract_store
+    return open_abstract_store(ABSTRACTS_FILE, ORIGINAL_CSV)
+
+
+def load_mappings(use_snapshot: bool = True):
+    snapshot = get_snapshot() if use_snapshot else None
+    if snapshot is not None:
+        mappings = {}
+        columns = snapshot.columns('mappings')
+        for category, raw, standard in zip(columns['category'], columns['raw'], columns['standard']):
+            mappings.setdefault(category, {})[raw] = standard
+        print("Loaded standardization mappings from snapshot")
+        return mappings
+
+    try:
+        with open(MAPPINGS_FILE, 'r', encoding=ENCODING) as f:
+            mappings = json.load(f)
+        print(f"Loaded standardization mappings")
+        return mappings
+    except FileNotFoundError:
+        print("No standardization mappings found - using LLM only")
+        return {}
+
+
+def load_url_df(use_snapshot: bool = True):
+    import pandas as pd
+    snapshot = get_snapshot() if use_snapshot else None
+    if snapshot is not None and snapshot.has_table('urls'):
+        return pd.DataFrame(snapshot.columns('urls'))
+
+    try:
+        return pd.read_csv(DATA_URL_FILE)
+    except FileNotFoundError:
+        print("Warning: recount3_raw_and_metadata_url.csv not found.")
+        return None
+
+
+# Loaded on first access, e.g. `from src.config import indexed_data`
+_LOADERS = {
+    'indexed_data': load_data,
+    'df_csv': load_csv,
+    'abstracts': load_abstracts,
+    'MAPPINGS': load_mappings,
+    'url_df': load_url_df,
+}
+
+
+def __getattr__(name):
+    if name in _LOADERS:
+        if name not in _loaded:
+            _loaded[name] = _LOADERS[name]()
+        return _loaded[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
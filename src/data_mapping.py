@@ -1,17 +1,44 @@
 # data_mapping.py
 """
 Standardize entities in parsed_data.json using LLM.
+Usage (from the repository root):
+    python -m src.data_mapping          (full mapping run)
+    python -m src.data_mapping -workers 8
+    python -m src.data_mapping update   (delta: map only new vocabulary of new/changed studies)
 """
 
 import json
 import ollama
+import os
+import time
 from collections import Counter
-
-# Configuration
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.checkpoint import JsonlCheckpoint, atomic_write_json
+from src.config import BASE_DIR
+from src.term_normalizer import cluster_terms, normalize_key
+
+# Configuration (paths are absolute, so the script works from any working directory)
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))  # Progress files stay next to the script
 MODEL = 'qwen2.5:7b'
-INPUT_FILE = '../data/parsed_data_final.json'
+INPUT_FILE = os.path.join(DATA_DIR, 'parsed_data_final.json')
 ENCODING = 'utf-8'
-OUTPUT_FILE = '../data/mapped_parsed_data_final.json'
+OUTPUT_FILE = os.path.join(DATA_DIR, 'mapped_parsed_data_final.json')
+MAPPINGS_OUTPUT_FILE = os.path.join(DATA_DIR, 'standardization_mappings_final.json')
+PROGRESS_FILE = os.path.join(SRC_DIR, 'mapping_progress.jsonl')  # Per-batch mappings, for resuming
+AFFECTED_FILE = os.path.join(DATA_DIR, 'affected_projects.json')  # Written by initial_data_parse.py update
+UNMAPPED_FILE = os.path.join(DATA_DIR, 'unmapped_terms.json')  # Coverage report of the last run
+CATEGORIES = ['diseases', 'drugs', 'techniques', 'cell_types', 'tissues', 'genes']
+BATCH_SIZE = 100  # Terms per LLM request
+EXACT_CLUSTER_CATEGORIES = {'genes', 'techniques'}  # No typo clustering: one letter changes the meaning
+CASE_SENSITIVE_CATEGORIES = {'genes'}  # Case is part of the name (human BRAF vs mouse Braf)
+MAPPING_WORKERS = 4  # Concurrent batch requests
+MAX_RETRIES = 2  # Retries per request on request errors
+RETRY_BACKOFF = 2.0  # Seconds, doubled after each retry
+OLLAMA_HOST = None  # None = ollama default (OLLAMA_HOST env or localhost)
+
+_client = None
+UNMAPPED_TERMS = {}  # category -> {term: count} left unmapped
 
 # Key mappings for LLM reference
 KEY_MAPPINGS = """
@@ -75,21 +102,31 @@ def get_unique_values(data: list, category: str) -> Counter:
             values[item] += 1
     return values
 
-def create_mapping(category: str, values: Counter) -> dict:
-    """
-    Use LLM to create standardization mapping in batches.
-    """
-    all_mappings = {}
-    items = list(values.most_common())
-    batch_size = 100
+def load_mapping_progress(checkpoint: JsonlCheckpoint) -> dict:
+    """Collect checkpointed batch mappings per category."""
+    progress = {}
+    for record in checkpoint.records():
+        progress.setdefault(record.get('category'), {}).update(record.get('mapping', {}))
+    return progress
+
 
-    for i in range(0, len(items), batch_size):
-        batch = items[i:i + batch_size]
-        value_list = [f'"{val}" ({count})' for val, count in batch]
+def get_client() -> ollama.Client:
+    """Shared Ollama client; its HTTP connection pool is reused across threads."""
+    global _client
+    if _client is None:
+        _client = ollama.Client(host=OLLAMA_HOST)
+    return _client
 
-        print(f"Processing batch {i // batch_size + 1} ({len(batch)} terms)...")
 
-        prompt = f"""
+def request_batch_mapping(category: str, batch: list) -> dict:
+    """
+    Ask the LLM to map one batch of (term, count) pairs.
+    Request errors are retried with backoff; an unparseable (e.g. truncated)
+    response raises ValueError so the caller can split the batch.
+    """
+    value_list = [f'"{val}" ({count})' for val, count in batch]
+
+    prompt = f"""
         Create a standardization mapping for these {category}.
     
         STANDARDIZATION RULES TO FOLLOW:
@@ -108,29 +145,133 @@ def create_mapping(category: str, values: Counter) -> dict:
         
         JSON:"""
 
+    for attempt in range(MAX_RETRIES + 1):
         try:
-            response = ollama.chat(
+            response = get_client().chat(
                 model=MODEL,
                 messages=[{'role': 'user', 'content': prompt}],
                 options={'temperature': 0}
             )
+            break
+        except Exception as e:
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(RETRY_BACKOFF * (2 ** attempt))
 
-            response_text = response['message']['content'].strip()
+    response_text = response['message']['content'].strip()
 
-            start = response_text.find('{')
-            end = response_text.rfind('}') + 1
-            if start != -1 and end > start:
-                response_text = response_text[start:end]
+    start = response_text.find('{')
+    end = response_text.rfind('}') + 1
+    if start != -1 and end > start:
+        response_text = response_text[start:end]
 
-            batch_mapping = json.loads(response_text)
-            all_mappings.update(batch_mapping)
+    try:
+        batch_mapping = json.loads(response_text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"unparseable response: {e}")
+    if not isinstance(batch_mapping, dict):
+        raise ValueError("response is not a JSON object")
+    return {k: v for k, v in batch_mapping.items() if isinstance(k, str) and isinstance(v, str) and v.strip()}
 
-        except Exception as e:
-            print(f"    Error in batch: {e}")
 
+def map_batch(category: str, batch: list) -> dict:
+    """
+    Map a batch, splitting it in half whenever the request fails or the
+    response leaves terms out, down to single terms.
+    """
+    try:
+        batch_mapping = request_batch_mapping(category, batch)
+    except Exception as e:
+        print(f"    Error in batch of {len(batch)}: {e}")
+        batch_mapping = {}
+
+    missing = [(val, count) for val, count in batch
+               if val not in batch_mapping and val.lower() not in batch_mapping]
+    if missing and len(batch) > 1:
+        if len(missing) < len(batch):
+            print(f"    {len(missing)}/{len(batch)} terms missing from response, re-mapping them")
+        half = (len(missing) + 1) // 2
+        for part in (missing[:half], missing[half:]):
+            if part:
+                batch_mapping.update(map_batch(category, part))
+    return batch_mapping
+
+
+def create_mapping(category: str, values: Counter, checkpoint: JsonlCheckpoint = None,
+                   done: dict = None, workers: int = None) -> dict:
+    """
+    Use LLM to create standardization mapping in batches, up to `workers`
+    batches at a time. Terms already in `done` are reused; each finished
+    batch is appended to `checkpoint`.
+    """
+    all_mappings = dict(done or {})
+    workers = workers or MAPPING_WORKERS
+
+    # Only one representative per cluster of spelling variants goes to the LLM
+    clusters = cluster_terms(values, fuzzy=category not in EXACT_CLUSTER_CATEGORIES,
+                             keep_case=category in CASE_SENSITIVE_CATEGORIES)
+    rep_counts = Counter({rep: sum(values[t] for t in variants) for rep, variants in clusters.items()})
+    print(f"Clustered {len(values)} terms into {len(clusters)} groups "
+          f"({len(values) - len(clusters)} fewer terms to map)")
+
+    if all_mappings:
+        propagate_cluster_mappings(clusters, all_mappings)
+    items = [(rep, count) for rep, count in rep_counts.most_common() if rep not in all_mappings]
+
+    if all_mappings:
+        print(f"Resuming: {len(all_mappings)} terms already mapped, {len(items)} to go")
+
+    batches = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+    print(f"Mapping {len(items)} terms in {len(batches)} batches ({workers} at a time)...")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(map_batch, category, batch): n for n, batch in enumerate(batches, 1)}
+        for finished, future in enumerate(as_completed(futures), 1):
+            batch_mapping = future.result()
+            all_mappings.update(batch_mapping)
+            # Checkpoint from this thread only, as batches finish
+            if checkpoint is not None and batch_mapping:
+                checkpoint.append({'batch_id': f"{category}:{futures[future]}",
+                                   'category': category, 'mapping': batch_mapping})
+            print(f"  Batch {futures[future]} done ({finished}/{len(batches)})")
+
+    propagate_cluster_mappings(clusters, all_mappings)
+    unmapped = coverage_report(category, values, all_mappings)
+    if unmapped:
+        UNMAPPED_TERMS[category] = unmapped
     return all_mappings
 
 
+def propagate_cluster_mappings(clusters: dict, mapping: dict) -> dict:
+    """
+    Give every unmapped variant the mapping of the mapped members of its
+    cluster. Clusters whose mapped members disagree are left alone: the
+    variants are not the same term after all.
+    """
+    for variants in clusters.values():
+        targets = {mapping[v] for v in variants if v in mapping}
+        if len(targets) != 1:
+            continue
+        mapped = targets.pop()
+        for variant in variants:
+            mapping.setdefault(variant, mapped)
+    return mapping
+
+
+def coverage_report(category: str, values: Counter, mapping: dict) -> dict:
+    """Print mapping coverage and return the unmapped terms with their counts."""
+    unmapped = {val: count for val, count in values.most_common()
+                if val not in mapping and val.lower() not in mapping}
+    total = sum(values.values())
+    covered = total - sum(unmapped.values())
+    print(f"Coverage: {len(values) - len(unmapped)}/{len(values)} terms, "
+          f"{covered}/{total} mentions ({covered / total:.1%})" if total else "Coverage: no terms")
+    if unmapped:
+        print(f"  Unmapped ({len(unmapped)}): " + ', '.join(list(unmapped)[:10]) +
+              (' ...' if len(unmapped) > 10 else ''))
+    return unmapped
+
+
 def apply_mapping(data: list, category: str, mapping: dict) -> list:
     """Apply standardization mapping to all studies."""
 
@@ -146,7 +287,97 @@ def apply_mapping(data: list, category: str, mapping: dict) -> list:
     return data
 
 
-def main():
+def map_unseen_values(studies: list, all_mappings: dict, checkpoint: JsonlCheckpoint = None,
+                      workers: int = None) -> dict:
+    """
+    Extend all_mappings with raw values of `studies` it does not cover yet.
+    Values whose normalization key matches an existing term reuse its mapping;
+    only the rest is sent to the LLM.
+    """
+    progress = load_mapping_progress(checkpoint) if checkpoint is not None else {}
+
+    for category in CATEGORIES:
+        mapping = all_mappings.setdefault(category, {})
+        values = get_unique_values(studies, category)
+        unseen = Counter({v: c for v, c in values.items() if v not in mapping and v.lower() not in mapping})
+        if not unseen:
+            continue
+
+        # Key -> standard value, or None where existing terms with that key map differently
+        keep_case = category in CASE_SENSITIVE_CATEGORIES
+        by_key = {}
+        for term, std in mapping.items():
+            key = normalize_key(term, keep_case)
+            by_key[key] = std if by_key.get(key, std) == std else None
+        for std in set(mapping.values()):
+            by_key.setdefault(normalize_key(std, keep_case), std)
+        reused = 0
+        for term in list(unseen):
+            std = by_key.get(normalize_key(term, keep_case))
+            if std is not None:
+                mapping[term] = std
+                del unseen[term]
+                reused += 1
+
+        print(f"\n{category}: {len(unseen) + reused} new terms, {reused} matched existing variants, "
+              f"{len(unseen)} sent to LLM")
+        if unseen:
+            mapping.update(create_mapping(category, unseen, checkpoint, progress.get(category), workers))
+
+    return all_mappings
+
+
+def update_mapped(affected: dict = None, workers: int = None):
+    """
+    Delta update of the mapped data.
+    Affected studies are the ones listed by an incremental re-index plus any
+    study that is in the parsed data but not yet mapped (or the other way
+    round). Only raw values unseen in the saved mappings are mapped with the
+    LLM, and the mappings are applied only to the affected studies.
+    """
+    if affected is None and os.path.exists(AFFECTED_FILE):
+        with open(AFFECTED_FILE, 'r', encoding=ENCODING) as f:
+            affected = json.load(f)
+    affected = affected or {}
+
+    with open(INPUT_FILE, 'r', encoding=ENCODING) as f:
+        parsed_data = json.load(f)
+    with open(OUTPUT_FILE, 'r', encoding=ENCODING) as f:
+        mapped_data = json.load(f)
+    with open(MAPPINGS_OUTPUT_FILE, 'r', encoding=ENCODING) as f:
+        all_mappings = json.load(f)
+
+    parsed_ids = {s['project'] for s in parsed_data}
+    mapped_ids = {s['project'] for s in mapped_data}
+    updated = set(affected.get('updated', [])) | (parsed_ids - mapped_ids)
+    removed = set(affected.get('removed', [])) | (mapped_ids - parsed_ids)
+    print(f"\nRe-mapping {len(updated)} updated/new studies, removing {len(removed)}...")
+
+    changed_studies = [s for s in parsed_data if s['project'] in updated]
+
+    checkpoint = JsonlCheckpoint(PROGRESS_FILE, key='batch_id', fsync_every=1)
+    all_mappings = map_unseen_values(changed_studies, all_mappings, checkpoint, workers)
+    checkpoint.close()
+
+    for category in CATEGORIES:
+        changed_studies = apply_mapping(changed_studies, category, all_mappings.get(category, {}))
+
+    # Replace in place, keep order, append new studies at the end
+    by_project = {s['project']: s for s in changed_studies}
+    mapped_data = [by_project.pop(s['project'], s) for s in mapped_data if s['project'] not in removed]
+    mapped_data.extend(by_project.values())
+
+    atomic_write_json(MAPPINGS_OUTPUT_FILE, all_mappings, indent=2)
+    print(f"Saved mappings to: {MAPPINGS_OUTPUT_FILE}")
+    atomic_write_json(OUTPUT_FILE, mapped_data, indent=2)
+    print(f"Saved {len(mapped_data)} studies to: {OUTPUT_FILE}")
+    checkpoint.remove()
+    if os.path.exists(AFFECTED_FILE):
+        os.remove(AFFECTED_FILE)
+    return mapped_data
+
+
+def main(workers: int = MAPPING_WORKERS):
     # Load data
     print(f"Loading {INPUT_FILE}...")
     with open(INPUT_FILE, 'r', encoding=ENCODING) as f:
@@ -154,10 +385,15 @@ def main():
     print(f"Loaded {len(data)} studies\n")
 
     # Categories to standardize
-    categories = ['diseases', 'drugs', 'techniques', 'cell_types', 'tissues', 'genes']
+    categories = CATEGORIES
+    before_counts = {category: len(get_unique_values(data, category)) for category in categories}
 
     all_mappings = {}
 
+    # Resume from batches mapped by an interrupted run
+    checkpoint = JsonlCheckpoint(PROGRESS_FILE, key='batch_id', fsync_every=1)
+    progress = load_mapping_progress(checkpoint)
+
     for category in categories:
         print(f"\n{'-'*50}")
         print(f"Processing: {category}")
@@ -177,7 +413,7 @@ def main():
 
         # Create mapping with LLM
         print(f"\nCreating standardization mapping with LLM...")
-        mapping = create_mapping(category, values)
+        mapping = create_mapping(category, values, checkpoint, progress.get(category), workers)
         all_mappings[category] = mapping
         print(f"Created mapping for {len(mapping)} terms")
 
@@ -198,29 +434,42 @@ def main():
     print("Saving files...")
     print(f"{'-'*50}")
 
-    with open('../data/standardization_mappings_final.json', 'w', encoding=ENCODING) as f:
-        json.dump(all_mappings, f, indent=2, ensure_ascii=False)
-    print(f"Saved mappings to: standardization_mappings_final.json")
+    checkpoint.close()
+    atomic_write_json(MAPPINGS_OUTPUT_FILE, all_mappings, indent=2)
+    print(f"Saved mappings to: {MAPPINGS_OUTPUT_FILE}")
 
     # Save standardized data
-    with open(OUTPUT_FILE, 'w', encoding=ENCODING) as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    atomic_write_json(OUTPUT_FILE, data, indent=2)
     print(f"Saved standardized data to: {OUTPUT_FILE}")
+    checkpoint.remove()
+
+    # Terms the LLM never mapped (kept as-is in the data)
+    atomic_write_json(UNMAPPED_FILE, UNMAPPED_TERMS, indent=2)
+    print(f"Saved unmapped terms to: {UNMAPPED_FILE}")
 
     # Final summary
     print(f"\n{'-'*50}")
     print("SUMMARY")
     print(f"{'-'*50}")
 
-    with open(INPUT_FILE, 'r', encoding=ENCODING) as f:
-        original_data = json.load(f)
     for category in categories:
-        before = len(get_unique_values(original_data, category))
+        before = before_counts[category]
         after = len(get_unique_values(data, category))
-        print(f"  {category}: {before} = {after} (-{before - after})")
+        print(f"  {category}: {before} = {after} (-{before - after}), "
+              f"unmapped: {len(UNMAPPED_TERMS.get(category, {}))}")
 
     print(f"\nDone! Saved to: {OUTPUT_FILE}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-workers", type=int, default=MAPPING_WORKERS, help="Concurrent batch requests")
+    parser.add_argument("mode", nargs="?", default="run")
+    args = parser.parse_args()
+
+    if args.mode == 'update':
+        update_mapped(workers=args.workers)
+    else:
+        main(workers=args.workers)
\ No newline at end of file
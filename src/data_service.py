@@ -0,0 +1,172 @@
+# data_service.py
+"""
+Process-wide data service shared by all Streamlit sessions.
+
+The data is loaded once per process (st.cache_resource survives module
+reloads and reruns) and handed out as read-only views: studies live in a
+compact StudyStore and are seen through read-only StudyViews, mappings are
+MappingProxyType, so no session can change what another one sees.
+Derived structures the pages need on every rerun (display rows, the Browse
+DataFrame, organism counts, facets) are computed here once; the lazy ones
+are built under a lock, so concurrent sessions never build them twice.
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from types import MappingProxyType
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import streamlit as st
+
+from src import config
+from src.facets import FacetIndex
+from src.registry import ProjectRegistry
+from src.study_store import StudyStore
+
+
+def freeze(value):
+    """Read-only copy: dicts become MappingProxyType, lists become tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+BROWSE_COLUMNS = ['Project', 'Title', 'Organism', 'Samples', 'Diseases', 'Tissue', 'Drugs', 'Genes', 'Techniques']
+SEARCH_KEYS = ['diseases', 'tissues', 'drugs', 'genes', 'techniques']
+FIELD_SEP = '\x1f'  # Between fields of the search column, so no term matches across two fields
+
+
+def display_row(s) -> MappingProxyType:
+    """Table row of a study as shown on the Browse and Chat pages."""
+    return MappingProxyType({
+        'Project': s.get('project', ''),
+        'Title': s.get('study_title', ''),
+        'Organism': s.get('organism', ''),
+        'Samples': s.get('n_samples', 0),
+        'Diseases': ', '.join(s.get('diseases') or ()),
+        'Tissue': ', '.join(s.get('tissues') or ()),
+        'Drugs': ', '.join(s.get('drugs') or ()),
+        'Genes': ', '.join(s.get('genes') or ()),
+        'Techniques': ', '.join(s.get('techniques') or ()),
+    })
+
+
+def deep_sizeof(obj, seen: set = None) -> int:
+    """Approximate size in bytes of obj and everything it references (shared objects once)."""
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        # A proxy's own size excludes the dict it wraps
+        size += sys.getsizeof(dict(item) if isinstance(item, MappingProxyType) else item)
+        if isinstance(item, (dict, MappingProxyType)):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__dict__'):
+            stack.append(vars(item))
+        elif hasattr(type(item), '__slots__'):
+            stack.extend(getattr(item, name) for name in type(item).__slots__ if hasattr(item, name))
+    return size
+
+
+class DataService:
+    """Loaded-once data and read-only views of it."""
+
+    def __init__(self):
+        start = time.time()
+        snapshot = config.get_snapshot()
+        if snapshot is not None:
+            self.studies = StudyStore.from_snapshot(snapshot)
+        else:
+            self.studies = StudyStore(config.load_data())
+        self.mappings = freeze(config.load_mappings())
+        self.registry = ProjectRegistry(self.studies, load_urls=config.load_url_df,
+                                        load_abstracts=config.load_abstracts)
+        self.display_rows = MappingProxyType({s['project']: display_row(s) for s in self.studies})
+        organisms = Counter()
+        for code, n in Counter(self.studies.organisms).items():
+            organisms[self.studies.organism_vocab.strings[code].lower()] += n
+        self.organism_counts = MappingProxyType(organisms)
+        self.load_seconds = time.time() - start
+        self._memory = None
+        self._browse_frame = None
+        self._facets = None
+        self._build_lock = threading.Lock()  # Guards the lazily built structures below
+        print(f"Data service ready: {len(self.studies)} studies in {self.load_seconds:.1f}s")
+
+    @property
+    def browse_frame(self):
+        """
+        Browse table of all studies as one DataFrame, built on first use.
+        Besides the display columns it has lowercased/uppercased helper
+        columns (_organism, _project, _search) for vectorized filtering.
+        Shared by all sessions: filter it, never modify it.
+        """
+        with self._build_lock:
+            if self._browse_frame is None:
+                self._browse_frame = self._build_browse_frame()
+        return self._browse_frame
+
+    def _build_browse_frame(self):
+        import pandas as pd
+        frame = pd.DataFrame([self.display_rows[s['project']] for s in self.studies], columns=BROWSE_COLUMNS)
+        frame['_organism'] = [str(s.get('organism', '')).lower() for s in self.studies]
+        frame['_project'] = frame['Project'].str.upper()
+        frame['_search'] = [
+            FIELD_SEP.join([s.get('study_title', ''), s.get('project', '')]
+                           + [' '.join(s.get(key) or ()) for key in SEARCH_KEYS]).lower()
+            for s in self.studies
+        ]
+        return frame
+
+    @property
+    def facets(self) -> FacetIndex:
+        """Facet bitsets over the studies (rows in the same order as browse_frame), built on first use."""
+        with self._build_lock:
+            if self._facets is None:
+                start = time.time()
+                self._facets = FacetIndex(self.studies)
+                print(f"Facet index built in {time.time() - start:.2f}s")
+        return self._facets
+
+    def memory_report(self) -> dict:
+        """Bytes held per component (objects shared between components counted once) and process peak RSS."""
+        with self._build_lock:
+            if self._memory is None:
+                self._memory = self._measure_memory()
+        if resource is None:
+            return dict(self._memory)
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {**self._memory, 'peak_rss': peak if sys.platform == 'darwin' else peak * 1024}
+
+    def _measure_memory(self) -> dict:
+        seen = set()
+        report = {
+            'studies': deep_sizeof(self.studies, seen),
+            'mappings': deep_sizeof(self.mappings, seen),
+            'registry': deep_sizeof(self.registry._studies, seen),
+            'display_rows': deep_sizeof(self.display_rows, seen),
+        }
+        report['total'] = sum(report.values())
+        return report
+
+
+@st.cache_resource(show_spinner="Loading studies...")
+def get_data_service() -> DataService:
+    """The process-wide DataService (one per server process, shared by all sessions)."""
+    return DataService()
@@ -0,0 +1,454 @@
+# downloader.py
+"""
+Concurrent download engine for recount3 files.
+
+- One pooled requests.Session shared by all workers (keep-alive connections)
+- At most PER_HOST_LIMIT concurrent transfers per host
+- Size-aware scheduling: sizes are probed with HEAD requests and by_size()
+  puts the largest files first, so one big junction file does not end up
+  running alone at the end
+- Progress in files and bytes (progress_stats)
+- Responses are streamed in chunks to spool files on disk, never held in
+  memory whole, so memory stays bounded by workers x CHUNK_SIZE
+- With a UrlCache, fresh cached files are served locally, stale ones are
+  revalidated with a conditional GET, and new downloads are added to it
+- Failed transfers are retried with exponential backoff. Bytes already
+  received are kept in a partial file per URL and the download continues
+  from there with an HTTP Range request, in the same run or the next one
+- Finished files are checked against the expected size (and Content-MD5 when
+  the server sends it); status_report() lists the outcome of every file
+"""
+
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.url_cache import link_or_copy
+
+MAX_WORKERS = 8  # Concurrent transfers overall
+PER_HOST_LIMIT = 6  # Concurrent transfers per host
+CONNECT_TIMEOUT = 10  # Seconds
+READ_TIMEOUT = 60  # Seconds without data before a transfer fails
+CHUNK_SIZE = 1024 * 1024
+SPOOL_DIR = os.path.join(tempfile.gettempdir(), 'recount3_downloads')
+SPOOL_MAX_AGE = 6 * 3600  # Seconds before leftover spool files are deleted
+MAX_ATTEMPTS = 4  # Tries per file, each resuming where the previous one stopped
+RETRY_BACKOFF = 2.0  # Seconds before the first retry, doubled for every further one
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)  # HTTP errors worth retrying
+MAX_SERVE_BYTES = 200 * 1024 ** 2  # Largest file handed to st.download_button, which holds it in memory
+
+# Already compressed payloads are stored in the ZIP as-is instead of re-deflated
+COMPRESSED_SUFFIXES = ('.gz', '.bgz', '.zip', '.bz2', '.xz', '.zst', '.bw', '.bigwig', '.bam')
+
+URL_COLUMNS = [
+    'raw_gene', 'raw_exon', 'raw_jxn_MM', 'raw_jxn_RR', 'raw_jxn_ID',
+    'project_meta', 'recount_project', 'recount_qc', 'recount_seq_qc', 'recount_pred'
+]
+
+
+class IntegrityError(Exception):
+    """A downloaded file does not match the expected size or checksum."""
+
+
+class DownloadTask:
+    """One file to fetch. `size` is known after probing (None if the server does not say)."""
+
+    def __init__(self, project: str, column: str, url: str):
+        self.project = project
+        self.column = column
+        self.url = url
+        self.size = None
+        self.bytes_done = 0
+        self.path = None  # Spool file with the downloaded bytes
+        self.error = None
+        self.done = False
+        self.cache_status = None  # 'hit', 'revalidated' or 'miss' when a cache is used
+        self.status = 'pending'  # downloading, retrying, done, resumed, cached or failed
+        self.attempts = 0
+        self.resumed_from = 0  # Bytes already on disk when the transfer was resumed
+
+    @property
+    def filename(self) -> str:
+        name = self.url.rstrip('/').split('/')[-1]
+        return name or f"{self.column}.txt"
+
+    @property
+    def host(self) -> str:
+        return urlsplit(self.url).netloc
+
+    def discard(self) -> None:
+        """Delete the spool file."""
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+
+def tasks_for_projects(projects: list, registry) -> tuple:
+    """Build download tasks from the registry's URL rows. Returns (tasks, projects without URLs)."""
+    tasks, missing = [], []
+    for project in projects:
+        row = registry.url_row(project)
+        if row is None:
+            missing.append(project)
+            continue
+        for column in URL_COLUMNS:
+            url = row.get(column)
+            if isinstance(url, str) and url.startswith('http'):
+                tasks.append(DownloadTask(project, column, url))
+    return tasks, missing
+
+
+def status_report(tasks: list) -> list:
+    """One row per file: status, bytes on disk vs expected size, attempts and error."""
+    return [{
+        'Project': t.project,
+        'File': t.filename,
+        'Status': t.status,
+        'Bytes': t.bytes_done,
+        'Size': t.size,
+        'Resumed from': t.resumed_from or None,
+        'Attempts': t.attempts,
+        'Error': t.error or '',
+    } for t in tasks]
+
+
+_url_locks = {}  # url -> [lock, threads holding or waiting for it]
+_url_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _url_lock(url: str):
+    """
+    Process-wide lock per URL, so two sessions never write the same partial
+    file. It is dropped once no thread holds or waits for it.
+    """
+    with _url_locks_guard:
+        entry = _url_locks.setdefault(url, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _url_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _url_locks[url]
+
+
+def partial_path(url: str) -> str:
+    """Spool path collecting the bytes of url; the same across runs so downloads can resume."""
+    name = url.rstrip('/').split('/')[-1][-60:]
+    return os.path.join(SPOOL_DIR, f"partial_{hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]}_{name}")
+
+
+def _read_meta(partial: str) -> dict:
+    """Validators and expected size of a partial file, recorded from its first response."""
+    try:
+        with open(partial + '.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(partial: str, meta: dict) -> None:
+    with open(partial + '.json', 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+
+def _remove_partial(partial: str) -> None:
+    for path in (partial, partial + '.json'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _content_range_total(value: str):
+    """Total size from a Content-Range header ('bytes 100-199/200' or 'bytes */200'), or None."""
+    total = value.rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+
+def _retryable(error: Exception) -> bool:
+    """Network errors, timeouts, integrity failures and transient HTTP statuses are retried."""
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUSES
+    return isinstance(error, (requests.RequestException, IntegrityError))
+
+
+class DownloadEngine:
+    """Fetches DownloadTasks over one pooled session; callers run fetch() on their own threads."""
+
+    def __init__(self, max_workers: int = MAX_WORKERS, per_host: int = PER_HOST_LIMIT, cache=None):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _slot(self, host: str) -> threading.Semaphore:
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def probe_size(self, task: DownloadTask) -> None:
+        """Fill task.size from a HEAD request (left None on any failure)."""
+        if self.cache is not None:
+            entry = self.cache.lookup(task.url)
+            if entry is not None:
+                task.size = entry['size']
+                return
+        try:
+            with self._slot(task.host):
+                response = self.session.head(task.url, allow_redirects=True, timeout=CONNECT_TIMEOUT)
+            if response.ok and response.headers.get('Content-Length', '').isdigit():
+                task.size = int(response.headers['Content-Length'])
+        except requests.RequestException:
+            pass
+
+    def _serve_cached(self, task: DownloadTask, entry: dict, status: str) -> DownloadTask:
+        """Link a cached file into the spool instead of downloading it."""
+        task.path = new_spool_path(f"_{task.filename}")
+        link_or_copy(entry['path'], task.path)
+        task.size = task.bytes_done = entry['size']
+        task.cache_status = status
+        task.status = 'cached'
+        self.cache.touch(task.url, revalidated=status == 'revalidated')
+        self.cache.record('hits' if status == 'hit' else 'revalidated')
+        self.cache.record('bytes_served', entry['size'])
+        task.done = True
+        return task
+
+    def fetch(self, task: DownloadTask) -> DownloadTask:
+        """
+        Download one task, retrying with exponential backoff. Each attempt
+        resumes from the partial file left by the previous one (also across
+        runs), and the finished file is verified before it is handed out.
+        """
+        with _url_lock(task.url):
+            entry = self.cache.lookup(task.url) if self.cache is not None else None
+            if entry is not None and not self.cache.verify(entry):
+                entry = None
+            if entry is not None and self.cache.is_fresh(entry):
+                return self._serve_cached(task, entry, 'hit')
+
+            partial = partial_path(task.url)
+            digest = None
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                task.attempts = attempt
+                try:
+                    if self._transfer(task, partial, entry) == 'revalidated':
+                        return self._serve_cached(task, entry, 'revalidated')
+                    digest = self._verify(task, partial)
+                    task.error = None
+                    break
+                except (requests.RequestException, OSError, IntegrityError) as e:
+                    task.error = str(e)
+                    if not _retryable(e):
+                        _remove_partial(partial)
+                        break
+                    if attempt < MAX_ATTEMPTS:
+                        task.status = 'retrying'
+                        print(f"Attempt {attempt} for {task.project}/{task.filename} failed ({e}), retrying")
+                        time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+
+            if digest is None:
+                # The partial file stays in the spool, so the next run resumes it
+                task.status = 'failed'
+                print(f"Failed to download {task.column} for {task.project}: {task.error}")
+                task.done = True
+                return task
+
+            # Hand the file out under a private name so the partial path is free for other sessions
+            task.path = new_spool_path(f"_{task.filename}")
+            os.replace(partial, task.path)
+            meta = _read_meta(partial)
+            _remove_partial(partial)
+
+        task.status = 'resumed' if task.resumed_from else 'done'
+        if self.cache is not None:
+            task.cache_status = 'miss'
+            self.cache.record('misses')
+            self.cache.record('bytes_fetched', task.bytes_done - task.resumed_from)
+            try:
+                self.cache.store(task.url, task.path, digest, meta.get('etag'), meta.get('last_modified'))
+            except OSError as e:
+                print(f"Could not cache {task.url}: {e}")
+        task.done = True
+        return task
+
+    def _transfer(self, task: DownloadTask, partial: str, entry) -> str:
+        """
+        One GET into the partial file: a Range request continuing it if it
+        already has bytes, a plain (or conditional, with a cache entry) GET
+        otherwise. Returns 'revalidated' on 304, 'complete' otherwise.
+        """
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        meta = _read_meta(partial)
+        if offset:
+            headers = {'Range': f"bytes={offset}-"}
+            # Only continue if the file is unchanged; otherwise the server sends it whole
+            validator = meta.get('etag') or meta.get('last_modified')
+            if validator:
+                headers['If-Range'] = validator
+        else:
+            headers = self.cache.conditional_headers(entry) if entry is not None else {}
+
+        task.status = 'downloading'
+        with self._slot(task.host), self.session.get(task.url, stream=True, headers=headers,
+                                                     timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+            if response.status_code == 304 and entry is not None and not offset:
+                return 'revalidated'
+            if response.status_code == 416 and offset:
+                # Nothing left to send: the partial file is already complete, or it is invalid
+                total = _content_range_total(response.headers.get('Content-Range', ''))
+                if total == offset or (total is None and task.size == offset):
+                    task.size = task.bytes_done = offset
+                    return 'complete'
+                _remove_partial(partial)
+                raise IntegrityError(f"server rejected resuming at byte {offset}, restarting")
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                mode = 'ab'
+                total = _content_range_total(response.headers.get('Content-Range', ''))
+                task.resumed_from = task.resumed_from or offset
+            else:
+                mode, offset = 'wb', 0
+                task.resumed_from = 0
+                length = response.headers.get('Content-Length', '')
+                total = task.size = int(length) if length.isdigit() else None
+                _write_meta(partial, {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'content_md5': response.headers.get('Content-MD5'),
+                    'size': total,
+                })
+            if total is not None:
+                task.size = total
+            task.bytes_done = offset
+            with open(partial, mode) as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    task.bytes_done += len(chunk)
+        return 'complete'
+
+    @staticmethod
+    def _verify(task: DownloadTask, partial: str) -> str:
+        """
+        Check the finished file against the expected size and, when the server
+        sent one, its Content-MD5. Returns its SHA-256; a file that fails is
+        deleted so the retry starts over.
+        """
+        meta = _read_meta(partial)
+        expected = task.size if task.size is not None else meta.get('size')
+        actual = os.path.getsize(partial)
+        if expected is not None and actual != expected:
+            if actual > expected:
+                _remove_partial(partial)
+            raise IntegrityError(f"size mismatch: got {actual} of {expected} bytes")
+        sha256, md5 = hashlib.sha256(), hashlib.md5()
+        with open(partial, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                md5.update(chunk)
+        if meta.get('content_md5') and base64.b64encode(md5.digest()).decode() != meta['content_md5']:
+            _remove_partial(partial)
+            raise IntegrityError("checksum mismatch (Content-MD5)")
+        return sha256.hexdigest()
+
+
+def by_size(tasks) -> list:
+    """Tasks largest first; unknown sizes go last."""
+    return sorted(tasks, key=lambda t: t.size if t.size is not None else -1, reverse=True)
+
+
+def progress_stats(tasks: list) -> dict:
+    """
+    Files and bytes done vs total. Total bytes counts known sizes only;
+    sizes_known says whether it covers every file.
+    """
+    active = [t for t in tasks if not t.done and t.bytes_done > 0]
+    return {
+        'files_done': sum(1 for t in tasks if t.done),
+        'files_total': len(tasks),
+        'failed': sum(1 for t in tasks if t.error),
+        'bytes_done': sum(t.bytes_done for t in tasks),
+        'bytes_total': sum(t.size or t.bytes_done for t in tasks),
+        'sizes_known': all(t.size is not None or t.done for t in tasks),
+        'active': [(t.project, t.filename, t.bytes_done, t.size) for t in active],
+    }
+
+
+def zip_compression(filename: str) -> int:
+    """ZIP_STORED for already compressed files, ZIP_DEFLATED otherwise."""
+    return zipfile.ZIP_STORED if filename.lower().endswith(COMPRESSED_SUFFIXES) else zipfile.ZIP_DEFLATED
+
+
+def new_spool_path(suffix: str) -> str:
+    """Path of a new, empty spool file (e.g. for a ZIP archive)."""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=SPOOL_DIR)
+    os.close(fd)
+    return path
+
+
+def cleanup_spool(max_age: float = SPOOL_MAX_AGE) -> None:
+    """Delete spool files older than max_age seconds (left by abandoned sessions)."""
+    if not os.path.isdir(SPOOL_DIR):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(SPOOL_DIR):
+        path = os.path.join(SPOOL_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def servable(path: str, max_bytes: int = MAX_SERVE_BYTES) -> bool:
+    """True if path is small enough to be served through st.download_button."""
+    return os.path.getsize(path) <= max_bytes
+
+
+def read_file(path: str, max_bytes: int = MAX_SERVE_BYTES) -> bytes:
+    """
+    Read a spooled file when the user actually downloads it. Streamlit keeps
+    download data in memory, so files over max_bytes are refused; point the
+    user to the file on disk instead.
+    """
+    size = os.path.getsize(path)
+    if size > max_bytes:
+        raise ValueError(f"{path} is {format_bytes(size)}, too large to serve through the browser")
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def format_bytes(n: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return f"{n:.0f} {unit}" if unit == 'B' else f"{n:.1f} {unit}"
+        n /= 1024
@@ -0,0 +1,194 @@
+# entity_tagger.py
+"""
+Dictionary-based entity tagger used before LLM extraction.
+
+The dictionary is built from the curated abbreviations in src/abbreviations.py
+and the standardized values of the mappings. Raw mapping keys are not used:
+they hold every phrase the LLM ever returned, including plain words such as
+"vehicle" or "treatment". Standardized values count only when at least
+MIN_STANDARD_SUPPORT raw terms map to them and they are not generic words.
+Matching is a longest-match lookup of token n-grams: upper-case symbols and
+genes match case-sensitively, other terms case-insensitively.
+
+Coverage is decided per category. A category is covered when it has a
+dictionary hit and no unmatched token looks like one of its entities
+(gene-like symbols, drug/disease/technique-like words) and no ambiguous
+phrase could belong to it. Tissues and cell types are plain words that no
+pattern can spot, so they need a hit. Drugs may also be covered empty: most
+abstracts name no drug, and drug names mostly carry a recognizable suffix.
+The LLM can be skipped for an abstract whose categories are all covered.
+"""
+
+import json
+import os
+import re
+from collections import Counter
+
+from src.abbreviations import CANCER, OTHER_DISEASES, TECHNIQUES, CELLTYPES
+
+ENTITY_KEYS = ['drugs', 'genes', 'cell_types', 'diseases', 'techniques', 'tissues']
+MAX_PHRASE_TOKENS = 6
+MIN_STANDARD_SUPPORT = 2  # Raw terms that must map to a standardized value before it is trusted
+MAY_BE_EMPTY = ('drugs',)  # Categories covered without a hit when nothing of their kind was missed
+
+TOKEN_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9\-+/.']*[A-Za-z0-9+]|[A-Za-z0-9]")
+
+# Mentions that need an explanation before the LLM can be skipped
+GENE_LIKE_RE = re.compile(r'^(?=.*[A-Z].*[A-Z0-9]|.*\d)[A-Z][A-Za-z0-9\-]{1,11}$')
+DRUG_LIKE_RE = re.compile(r'(mab|nib|ciclib|platin|taxel|rubicin|parib|statin|formin|methasone|mycin|cillin)$',
+                          re.IGNORECASE)
+DISEASE_LIKE_RE = re.compile(r'(cancer|carcinoma|oma|leukemia|leukaemia|tumou?r|disease|syndrome|itis)$',
+                             re.IGNORECASE)
+TECHNIQUE_LIKE_RE = re.compile(r'(seq|sequencing|array|microarray|PCR|CRISPR)$', re.IGNORECASE)
+
+# Acronyms that are not entities on their own
+STOP_SYMBOLS = {
+    'RNA', 'DNA', 'mRNA', 'USA', 'UK', 'II', 'III', 'IV', 'GEO', 'TCGA', 'CCLE', 'NIH', 'NCBI',
+    'SRA', 'SRP', 'GSE', 'ID', 'IDs', 'OR', 'HR', 'CI', 'SD', 'SE', 'vs', 'NGS',
+}
+# Generic words that appear as mapping values but say nothing about a study
+GENERIC_TERMS = {
+    'human', 'humans', 'mouse', 'mice', 'rat', 'rats', 'zebrafish', 'patient', 'patients', 'cell', 'cells',
+    'tissue', 'tissues', 'sample', 'samples', 'expression', 'gene expression', 'control', 'controls',
+    'cell line', 'cell lines', 'stem cell', 'stem cells', 'tumor', 'tumors', 'tumour', 'cancer', 'organ',
+    'gland', 'fluid', 'nucleus', 'normal tissue', 'total rna', 'vehicle', 'treatment', 'stimulation',
+    'stress', 'aging', 'analysis', 'technique', 'tool', 'kit', 'sequencing', 'profiling', 'sorting',
+    'extraction', 'knockdown', 'knockout', 'sequencing platform', 'analysis tool',
+}
+
+
+def _surface_key(text: str) -> str:
+    return ' '.join(TOKEN_RE.findall(text))
+
+
+def _is_case_sensitive(term: str) -> bool:
+    return term.upper() == term and any(c.isalpha() for c in term)
+
+
+class EntityTagger:
+    """Longest-match dictionary tagger over token n-grams."""
+
+    def __init__(self, entries: list):
+        # surface -> {category: summed weight}; a category wins if it has at
+        # least twice the weight of the runner-up, otherwise the surface is ambiguous
+        scores = {}
+        for surface, category, weight in entries:
+            key = _surface_key(surface)
+            if not key:
+                continue
+            if category == 'genes' or _is_case_sensitive(surface):
+                table_key = ('exact', key)
+            else:
+                table_key = ('folded', key.lower())
+            weights = scores.setdefault(table_key, {})
+            weights[category] = weights.get(category, 0) + weight
+
+        self.exact = {}
+        self.folded = {}
+        for (table, key), weights in scores.items():
+            ranked = sorted(weights.items(), key=lambda cw: cw[1], reverse=True)
+            if len(ranked) == 1 or ranked[0][1] >= 2 * ranked[1][1]:
+                categories = {ranked[0][0]}
+            else:
+                categories = {c for c, _ in ranked}
+            (self.exact if table == 'exact' else self.folded)[key] = categories
+
+    def __len__(self):
+        return len(self.exact) + len(self.folded)
+
+    def _lookup(self, phrase: str) -> set:
+        return self.exact.get(phrase) or self.folded.get(phrase.lower())
+
+    def tag(self, text: str) -> tuple:
+        """
+        Return (entities, covered categories) for text.
+        Ambiguous surfaces (several categories) are not tagged and leave all
+        their categories uncovered.
+        """
+        tokens = TOKEN_RE.findall(text or '')
+        entities = {key: [] for key in ENTITY_KEYS}
+        seen = set()
+        missed = set()
+
+        i = 0
+        while i < len(tokens):
+            for n in range(min(MAX_PHRASE_TOKENS, len(tokens) - i), 0, -1):
+                phrase = ' '.join(tokens[i:i + n])
+                categories = self._lookup(phrase)
+                if categories:
+                    break
+            else:
+                missed.update(self._candidate_categories(tokens[i]))
+                i += 1
+                continue
+
+            if len(categories) > 1:
+                missed.update(categories)
+            else:
+                category = next(iter(categories))
+                if (category, phrase.lower()) not in seen:
+                    seen.add((category, phrase.lower()))
+                    entities[category].append(phrase)
+            i += n
+
+        covered = {key for key in ENTITY_KEYS
+                   if key not in missed and (entities[key] or key in MAY_BE_EMPTY)}
+        return entities, covered
+
+    @staticmethod
+    def _candidate_categories(token: str) -> list:
+        """Categories an unmatched token looks like an entity of."""
+        if token in STOP_SYMBOLS:
+            return []
+        patterns = (('genes', GENE_LIKE_RE.match), ('drugs', DRUG_LIKE_RE.search),
+                    ('diseases', DISEASE_LIKE_RE.search), ('techniques', TECHNIQUE_LIKE_RE.search))
+        return [key for key, matches in patterns if matches(token)]
+
+
+def dictionary_entries(mappings: dict = None) -> list:
+    """
+    (surface, category, weight) triples from the curated abbreviations and the
+    standardized mapping values. Abbreviations weigh most; a standardized value
+    weighs the number of raw terms mapped to it.
+    """
+    entries = []
+    for category, table in (('diseases', {**CANCER, **OTHER_DISEASES}),
+                            ('techniques', TECHNIQUES),
+                            ('cell_types', CELLTYPES)):
+        for values in table.values():
+            entries.extend((value, category, 10) for value in values)
+
+    for category, mapping in (mappings or {}).items():
+        if category not in ENTITY_KEYS:
+            continue
+        support = Counter(v for v in mapping.values() if isinstance(v, str))
+        for surface, weight in support.items():
+            if weight < MIN_STANDARD_SUPPORT or len(surface) < 3:
+                continue
+            if category == 'genes' and not GENE_LIKE_RE.match(surface):
+                continue
+            if surface in STOP_SYMBOLS or surface.lower() in GENERIC_TERMS:
+                continue
+            entries.append((surface, category, weight))
+    return entries
+
+
+def build_tagger(mappings_file: str = None) -> EntityTagger:
+    """Build a tagger from the abbreviations plus the mappings file if it exists."""
+    mappings = {}
+    if mappings_file and os.path.exists(mappings_file):
+        with open(mappings_file, 'r', encoding='utf-8') as f:
+            mappings = json.load(f)
+    return EntityTagger(dictionary_entries(mappings))
+
+
+def merge_entities(extracted: dict, tagged: dict) -> dict:
+    """Add dictionary hits the LLM missed (case-insensitive de-duplication)."""
+    for key in ENTITY_KEYS:
+        values = extracted.get(key)
+        if not isinstance(values, list):
+            values = []
+        present = {str(v).lower() for v in values}
+        values.extend(v for v in tagged.get(key, []) if v.lower() not in present)
+        extracted[key] = values
+    return extracted
@@ -0,0 +1,116 @@
+# export.py
+"""
+Streaming export of studies to CSV, JSONL or Parquet.
+
+Rows are read straight from the StudyStore (plus the abstract store and the
+URL table when asked for) and written to a spool file CHUNK_ROWS at a time,
+so exporting the whole catalogue never holds more than one chunk of rows in
+memory. Entity lists stay lists in JSONL and Parquet and are joined with
+', ' in CSV. Parquet needs pyarrow and is only offered when it is installed.
+"""
+
+import csv
+import json
+from itertools import islice
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+from src.downloader import URL_COLUMNS, new_spool_path
+from src.study_store import ENTITY_KEYS
+
+CHUNK_ROWS = 2000  # Studies per written chunk (Parquet row group)
+BASE_COLUMNS = ['project', 'study_title', 'organism', 'n_samples', *ENTITY_KEYS]
+
+# format -> (file extension, MIME type)
+FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'JSONL': ('jsonl', 'application/x-ndjson'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def available_formats() -> list:
+    return [fmt for fmt in FORMATS if fmt != 'Parquet' or pa is not None]
+
+
+def export_columns(with_abstracts: bool = False, with_urls: bool = False) -> list:
+    columns = list(BASE_COLUMNS)
+    if with_abstracts:
+        columns.append('study_abstract')
+    if with_urls:
+        columns.extend(URL_COLUMNS)
+    return columns
+
+
+def iter_rows(projects, registry, with_abstracts: bool = False, with_urls: bool = False):
+    """Yield one export row (dict) per known project, in the given order."""
+    for project in projects:
+        study = registry.study(project)
+        if study is None:
+            continue
+        row = {key: study.get(key) for key in BASE_COLUMNS}
+        for key in ENTITY_KEYS:
+            row[key] = list(row[key] or ())
+        if with_abstracts:
+            record = registry.abstract(project)
+            row['study_abstract'] = record['study_abstract'] if record else None
+        if with_urls:
+            url_row = registry.url_row(project) or {}
+            row.update((column, url_row.get(column)) for column in URL_COLUMNS)
+        yield row
+
+
+def chunks(rows, size: int = CHUNK_ROWS):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def _write_csv(path: str, rows, columns: list) -> None:
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for chunk in chunks(rows):
+            writer.writerows({k: ', '.join(v) if isinstance(v, list) else v for k, v in row.items()}
+                             for row in chunk)
+
+
+def _write_jsonl(path: str, rows, columns: list) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        for chunk in chunks(rows):
+            f.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in chunk))
+
+
+def _parquet_schema(columns: list):
+    types = {'n_samples': pa.int64(), **{key: pa.list_(pa.string()) for key in ENTITY_KEYS}}
+    return pa.schema([(column, types.get(column, pa.string())) for column in columns])
+
+
+def _write_parquet(path: str, rows, columns: list) -> None:
+    schema = _parquet_schema(columns)
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in chunks(rows):
+            for row in chunk:
+                # Values that do not fit the column type (e.g. a non-integer n_samples) become null
+                if not isinstance(row['n_samples'], int) or isinstance(row['n_samples'], bool):
+                    row['n_samples'] = None
+            writer.write_batch(pa.RecordBatch.from_pylist(chunk, schema=schema))
+
+
+WRITERS = {'CSV': _write_csv, 'JSONL': _write_jsonl, 'Parquet': _write_parquet}
+
+
+def export_studies(projects, registry, fmt: str = 'CSV', with_abstracts: bool = False,
+                   with_urls: bool = False, path: str = None) -> str:
+    """Write the given projects to path (a new spool file by default) and return the path."""
+    if fmt not in available_formats():
+        raise ValueError(f"Unsupported export format: {fmt}")
+    path = path or new_spool_path(f".{FORMATS[fmt][0]}")
+    rows = iter_rows(projects, registry, with_abstracts, with_urls)
+    WRITERS[fmt](path, rows, export_columns(with_abstracts, with_urls))
+    return path
+
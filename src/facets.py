@@ -0,0 +1,138 @@
+# facets.py
+"""
+Facet index: which studies mention each disease, technique, tissue, drug and
+cell type, as bitsets over StudyStore rows (bit i = row i).
+
+Filters are combined as Python ints (& and |), and a facet count is the
+popcount of a value's bitset intersected with the current filter mask, so
+refreshing the counts never re-reads the studies. Values mentioned by at
+most SPARSE_LIMIT studies (most of a long-tailed vocabulary) get no
+full-width bitset, since a Python int is as wide as its highest bit; their
+(row, value) pairs are kept as two arrays and counted in one vectorized
+bincount over the unpacked mask. Needs Python 3.10+ (int.bit_count).
+"""
+
+import heapq
+
+import numpy as np
+
+from src.study_store import ENTITY_KEYS
+
+FACET_KEYS = ('diseases', 'techniques', 'tissues', 'drugs', 'cell_types')
+FACET_LABELS = {'diseases': 'Disease', 'techniques': 'Technique', 'tissues': 'Tissue',
+                'drugs': 'Drug', 'cell_types': 'Cell type'}
+SPARSE_LIMIT = 16  # Values in at most this many studies are stored as row lists
+
+
+class FacetIndex:
+    """Per-value study bitsets for the facet categories of a StudyStore."""
+
+    def __init__(self, store, keys: tuple = FACET_KEYS, sparse_limit: int = SPARSE_LIMIT):
+        self.size = len(store)
+        self.nbytes = (self.size + 7) // 8
+        self.all = (1 << self.size) - 1
+        self.bitsets = {}  # key -> {value: int}
+        self.sparse = {}  # key -> {value: tuple of rows}
+        self.sparse_values = {}  # key -> list of sparse values (index = value id below)
+        self.sparse_pairs = {}  # key -> (rows, value ids) as int32 arrays, one entry per mention
+        self.sparse_rank = {}  # key -> alphabetical rank of each sparse value, for tie-breaking
+        self.totals = {}  # key -> {value: number of studies}
+        for key in keys:
+            if key not in ENTITY_KEYS:
+                raise ValueError(f"Not an entity category: {key}")
+            self._index(store, key, sparse_limit)
+
+    def _index(self, store, key: str, sparse_limit: int) -> None:
+        strings, offsets, ids = store.vocab[key].strings, store.offsets[key], store.entity_ids[key]
+        rows_by_id = [[] for _ in strings]
+        for row in range(self.size):
+            for i in ids[offsets[row]:offsets[row + 1]]:
+                rows = rows_by_id[i]
+                if not rows or rows[-1] != row:  # A value listed twice in one study counts once
+                    rows.append(row)
+
+        bitsets, sparse, totals = {}, {}, {}
+        pair_rows, pair_ids = [], []
+        for i, rows in enumerate(rows_by_id):
+            if not rows:
+                continue
+            value = strings[i]
+            totals[value] = len(rows)
+            if len(rows) <= sparse_limit:
+                pair_rows.extend(rows)
+                pair_ids.extend([len(sparse)] * len(rows))
+                sparse[value] = tuple(rows)
+                continue
+            bits = bytearray(self.nbytes)
+            for row in rows:
+                bits[row >> 3] |= 1 << (row & 7)
+            bitsets[value] = int.from_bytes(bits, 'little')
+        self.bitsets[key], self.sparse[key], self.totals[key] = bitsets, sparse, totals
+        self.sparse_values[key] = list(sparse)
+        self.sparse_pairs[key] = (np.array(pair_rows, dtype=np.int32), np.array(pair_ids, dtype=np.int32))
+        rank = np.empty(len(sparse), dtype=np.int32)
+        rank[sorted(range(len(sparse)), key=self.sparse_values[key].__getitem__)] = np.arange(len(sparse))
+        self.sparse_rank[key] = rank
+
+    def value_mask(self, key: str, value: str) -> int:
+        """Studies mentioning value (0 if none do)."""
+        if value in self.bitsets[key]:
+            return self.bitsets[key][value]
+        mask = 0
+        for row in self.sparse[key].get(value, ()):
+            mask |= 1 << row
+        return mask
+
+    def mask(self, key: str, values) -> int:
+        """Studies mentioning any of values; all studies if values is empty."""
+        if not values:
+            return self.all
+        mask = 0
+        for value in values:
+            mask |= self.value_mask(key, value)
+        return mask
+
+    def selection_mask(self, selections: dict, skip: str = None) -> int:
+        """Studies matching every facet in selections ({key: values}), ignoring facet `skip`."""
+        mask = self.all
+        for key, values in selections.items():
+            if key != skip and values:
+                mask &= self.mask(key, values)
+        return mask
+
+    def counts(self, key: str, mask: int, limit: int = None) -> dict:
+        """
+        {value: studies in mask mentioning it} for values with a non-zero
+        count, largest first (only the `limit` largest if given).
+        """
+        if mask == self.all:
+            counts = self.totals[key]
+        else:
+            counts = {}
+            for value, bitset in self.bitsets[key].items():
+                n = (bitset & mask).bit_count()
+                if n:
+                    counts[value] = n
+            rows, ids = self.sparse_pairs[key]
+            if len(rows):
+                hits = np.bincount(ids[self.to_bools(mask)[rows]], minlength=len(self.sparse_values[key]))
+                found = np.flatnonzero(hits)
+                if limit is not None and len(found) > limit:
+                    # Same order as the final sort (count, then name), so only `limit` candidates are needed
+                    found = found[np.lexsort((self.sparse_rank[key][found], -hits[found]))[:limit]]
+                values = self.sparse_values[key]
+                counts.update((values[i], int(hits[i])) for i in found)
+        order = lambda item: (-item[1], item[0])
+        if limit is not None and limit < len(counts):
+            return dict(heapq.nsmallest(limit, counts.items(), key=order))
+        return dict(sorted(counts.items(), key=order))
+
+    def from_bools(self, flags) -> int:
+        """Bitset of a boolean sequence over all rows (e.g. a pandas filter mask)."""
+        packed = np.packbits(np.asarray(flags, dtype=bool), bitorder='little')
+        return int.from_bytes(packed.tobytes(), 'little')
+
+    def to_bools(self, mask: int):
+        """Boolean numpy array over all rows from a bitset."""
+        packed = np.frombuffer(mask.to_bytes(self.nbytes, 'little'), dtype=np.uint8)
+        return np.unpackbits(packed, bitorder='little', count=self.size).astype(bool)
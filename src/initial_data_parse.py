@@ -5,8 +5,22 @@ Args:
     start_idx: Start from this row index
     end_idx: End at this row index
     chunk: Process this many entries then stop
-Usage:
-    python initial_data_parse.py -chunk n
+    workers: Number of concurrent requests to Ollama
+    pack: Number of abstracts sent per request
+    shard/num-shards/host: Process only shard i of n (by project-ID hash) against one Ollama host
+Usage (from the repository root):
+    python -m src.initial_data_parse -chunk n
+    python -m src.initial_data_parse -workers 4 -pack 4
+    python -m src.initial_data_parse benchmark -sample 20 -pack 4
+    python -m src.initial_data_parse update  (re-extract only new/changed abstracts)
+    python -m src.initial_data_parse -shard 0 -num-shards 2 -host http://gpu-a:11434
+    python -m src.initial_data_parse -shard 1 -num-shards 2 -host http://gpu-b:11434
+    python -m src.initial_data_parse merge -num-shards 2
+Note:
+    Concurrent requests only help if the Ollama server runs them in parallel
+    (set OLLAMA_NUM_PARALLEL on the server to at least the number of workers).
+    To try sharding on one machine, start extra servers on other ports
+    (e.g. OLLAMA_HOST=127.0.0.1:11435 ollama serve) and point each shard at one.
 """
 
 import pandas as pd
@@ -14,48 +28,158 @@ import json
 import ollama
 import time
 import datetime
+import hashlib
 import os
-
-# I/O
-INPUT_FILE = '../data/full_dataset.csv'
+import re
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from src.abbreviations import CANCER, OTHER_DISEASES, TECHNIQUES, CELLTYPES
+from src.checkpoint import JsonlCheckpoint, atomic_write_json
+from src.config import BASE_DIR
+from src.entity_tagger import build_tagger, merge_entities
+
+# I/O (paths are absolute, so the script works from any working directory)
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))  # Progress files stay next to the script
+INPUT_FILE = os.path.join(DATA_DIR, 'full_dataset.csv')
 ENCODING = 'utf-8'
-OUTPUT_FILE = '../data/parsed_data_final.json'
-PROGRESS_FILE = 'parsed_data_progress.json'
+OUTPUT_FILE = os.path.join(DATA_DIR, 'parsed_data_final.json')
+PROGRESS_FILE = os.path.join(SRC_DIR, 'parsed_data_progress.jsonl')
+LEGACY_PROGRESS_FILE = os.path.join(SRC_DIR, 'parsed_data_progress.json')
+MANIFEST_FILE = os.path.join(DATA_DIR, 'parsed_manifest.json')  # Content hash per project
+UPDATE_PROGRESS_FILE = os.path.join(SRC_DIR, 'update_progress.jsonl')
+AFFECTED_FILE = os.path.join(DATA_DIR, 'affected_projects.json')  # Studies touched by the last update
+PROMPT_VERSION = 2  # Bump when the extraction prompt changes to re-extract everything
 MODEL = 'qwen2.5:7b'
 BATCH_SIZE = 10  # Save progress every N abstracts
+WORKERS = 1  # Concurrent extraction requests
+MAX_RETRIES = 3  # Retries per abstract on request errors
+RETRY_BACKOFF = 2.0  # Seconds, doubled after each retry
+OLLAMA_HOST = None  # None = ollama default (OLLAMA_HOST env or localhost)
+PACK_SIZE = 1  # Abstracts sent per request
+PRUNE_REFERENCE = True  # Only list abbreviations that occur in the abstract
+DICTIONARY_NER = False  # Tag known entities locally, skip the LLM for fully covered abstracts (-ner)
+MAPPINGS_FILE = os.path.join(DATA_DIR, 'standardization_mappings_final.json')  # Vocabulary for the tagger
+ENTITY_KEYS = ['drugs', 'genes', 'cell_types', 'diseases', 'techniques', 'tissues']
+
+_client = None
+_tagger = None
+_stats_lock = threading.Lock()
+TOKEN_STATS = Counter()  # requests, llm_studies, prompt_tokens, eval_tokens, llm_seconds, slot_failures, ner_skipped
+
+
+def get_tagger():
+    """Dictionary entity tagger, built once from abbreviations and mappings."""
+    global _tagger
+    if _tagger is None:
+        _tagger = build_tagger(MAPPINGS_FILE)
+        print(f"Entity dictionary: {len(_tagger)} terms")
+    return _tagger
+
+
+def get_client() -> ollama.Client:
+    """Shared Ollama client; its HTTP connection pool is reused across threads."""
+    global _client
+    if _client is None:
+        _client = ollama.Client(host=OLLAMA_HOST)
+    return _client
+
+
+def chat_with_retry(prompt: str, client: ollama.Client = None) -> str:
+    """Send one prompt, retrying request errors with exponential backoff."""
+    client = client or get_client()
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            request_start = time.time()
+            response = client.chat(
+                model=MODEL,
+                messages=[{'role': 'user', 'content': prompt}],
+                options={'temperature': 0}
+            )
+            with _stats_lock:
+                TOKEN_STATS['requests'] += 1
+                TOKEN_STATS['llm_seconds'] += time.time() - request_start
+                TOKEN_STATS['prompt_tokens'] += response.get('prompt_eval_count') or 0
+                TOKEN_STATS['eval_tokens'] += response.get('eval_count') or 0
+            return response['message']['content'].strip()
+        except Exception as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = RETRY_BACKOFF * (2 ** attempt)
+            print(f"  Request failed ({e}), retrying in {delay:.0f}s...")
+            time.sleep(delay)
+
+
+def parse_extraction(response_text: str):
+    """Parse the JSON object out of an LLM response."""
+    start = response_text.find('{')
+    end = response_text.rfind('}') + 1
+    if start != -1 and end > start:
+        response_text = response_text[start:end]
+    return json.loads(response_text)
+
+
+def validate_extraction(extracted) -> dict:
+    """Return a clean entity dict, or None if the result is unusable."""
+    if not isinstance(extracted, dict):
+        return None
+    clean = {}
+    for key in ENTITY_KEYS:
+        values = extracted.get(key) or []
+        if not isinstance(values, list):
+            return None
+        clean[key] = [str(v) for v in values if isinstance(v, (str, int, float))]
+    return clean
+
+
+def add_metadata(extracted: dict, row) -> dict:
+    """Add original metadata"""
+    extracted['project'] = row['project']
+    extracted['organism'] = row['organism']
+    extracted['n_samples'] = row['n_samples']
+    extracted['study_title'] = row['study_title']
+    return extracted
 
 
-def rowwise_extract(row) -> dict:
-    """
-    Extract structured information from each row.
+def compile_reference() -> tuple:
     """
-    # Load your categorized dictionaries
-    from src.abbreviations import CANCER, OTHER_DISEASES, TECHNIQUES, CELLTYPES
-
-    # Format each category for the prompt
-    techniques_list = [f"{values[0]} = {values[-1]}" for key, values in TECHNIQUES.items()]
-    diseases_list = [f"{values[0]} = {values[-1]}" for key, values in {**CANCER, **OTHER_DISEASES}.items()]
-    cells_list = [f"{values[0]} = {values[-1]}" for key, values in CELLTYPES.items()]
-
-    # Build reference text
-    reference = f"""
-    KNOWN TECHNIQUE ABBREVIATIONS (these are NOT genes - put in "techniques"):
-    {chr(10).join(techniques_list)}
-
-    KNOWN DISEASE/CANCER ABBREVIATIONS (put in "diseases"):
-    {chr(10).join(diseases_list)}
-
-    KNOWN CELL TYPE ABBREVIATIONS (put in "cell_types"):
-    {chr(10).join(cells_list)}
+    Precompile the abbreviation reference once: the formatted line for every
+    entry, per section, plus one multi-pattern regex over all its terms.
+    Upper-case abbreviations (ALL, MS, PD) match case-sensitively so common
+    words do not pull them in; everything else matches case-insensitively.
     """
-
-    prompt = f"""
-    Extract entities from this gene expression study abstract.
-
-    CATEGORIZATION GUIDE (use these to categorize correctly):
-    {reference}
-    
-    For Drugs and Genes:
+    sections = [
+        ('KNOWN TECHNIQUE ABBREVIATIONS (these are NOT genes - put in "techniques"):', TECHNIQUES),
+        ('KNOWN DISEASE/CANCER ABBREVIATIONS (put in "diseases"):', {**CANCER, **OTHER_DISEASES}),
+        ('KNOWN CELL TYPE ABBREVIATIONS (put in "cell_types"):', CELLTYPES),
+    ]
+
+    lines = []  # (section index, formatted line)
+    exact_terms, folded_terms = {}, {}
+    for section_idx, (_, entries) in enumerate(sections):
+        for key, values in entries.items():
+            line_idx = len(lines)
+            lines.append((section_idx, f"{values[0]} = {values[-1]}"))
+            for term in values:
+                if term.upper() == term and any(c.isalpha() for c in term):
+                    exact_terms.setdefault(term, set()).add(line_idx)
+                else:
+                    folded_terms.setdefault(term.lower(), set()).add(line_idx)
+
+    def alternation(terms):
+        return '|'.join(re.escape(t) for t in sorted(terms, key=len, reverse=True))
+
+    boundary = r'(?<![A-Za-z0-9])({})(?![A-Za-z0-9])'
+    exact_re = re.compile(boundary.format(alternation(exact_terms)))
+    folded_re = re.compile(boundary.format(alternation(folded_terms)), re.IGNORECASE)
+    return [title for title, _ in sections], lines, (exact_re, exact_terms), (folded_re, folded_terms)
+
+
+REFERENCE_TITLES, REFERENCE_LINES, _EXACT_MATCHER, _FOLDED_MATCHER = compile_reference()
+FULL_REFERENCE_IDS = range(len(REFERENCE_LINES))
+
+GUIDE_RULES = """For Drugs and Genes:
     DRUG EXAMPLES:
     - Chemotherapy: Cisplatin, Doxorubicin, Paclitaxel, 5-Fluorouracil
     - Targeted therapy: Vemurafenib, Imatinib, Erlotinib, Trastuzumab
@@ -73,7 +197,58 @@ def rowwise_extract(row) -> dict:
     - The abbreviations above are for categorization only - do NOT extract them unless they appear in the text
     - WES, WGS, RRBS, scRNA-seq, etc. are TECHNIQUES, not genes
     - Gene symbols look like: TP53, BRAF, EGFR, KRAS, MYC, CD8, IL6
-    - Database names (CCLE, TCGA, GEO) are neither genes nor techniques - ignore them
+    - Database names (CCLE, TCGA, GEO) are neither genes nor techniques - ignore them"""
+
+
+def relevant_reference_ids(text: str) -> set:
+    """Indices of reference lines whose terms occur in text."""
+    line_ids = set()
+    for match in _EXACT_MATCHER[0].finditer(text):
+        line_ids |= _EXACT_MATCHER[1][match.group(1)]
+    for match in _FOLDED_MATCHER[0].finditer(text):
+        line_ids |= _FOLDED_MATCHER[1][match.group(1).lower()]
+    return line_ids
+
+
+def build_guide(rows: list) -> str:
+    """
+    Categorization guide for the given rows.
+    With PRUNE_REFERENCE only abbreviations found in their text are listed.
+    """
+    if PRUNE_REFERENCE:
+        line_ids = set()
+        for row in rows:
+            line_ids |= relevant_reference_ids(f"{row['study_title']}\n{row['study_abstract']}")
+    else:
+        line_ids = FULL_REFERENCE_IDS
+
+    section_lines = [[] for _ in REFERENCE_TITLES]
+    for line_idx in sorted(line_ids):
+        section_idx, line = REFERENCE_LINES[line_idx]
+        section_lines[section_idx].append(line)
+
+    reference = ''.join(
+        f"""
+    {title}
+    {chr(10).join(lines)}
+"""
+        for title, lines in zip(REFERENCE_TITLES, section_lines) if lines
+    )
+
+    return f"""CATEGORIZATION GUIDE (use these to categorize correctly):
+    {reference}
+    
+    {GUIDE_RULES}"""
+
+
+def rowwise_extract(row, client: ollama.Client = None) -> dict:
+    """
+    Extract structured information from each row.
+    """
+    prompt = f"""
+    Extract entities from this gene expression study abstract.
+
+    {build_guide([row])}
     
     Title: {row['study_title']}
     
@@ -92,21 +267,8 @@ def rowwise_extract(row) -> dict:
     JSON:"""
 
     try:
-        response = ollama.chat(
-            model=MODEL,
-            messages=[{'role': 'user', 'content': prompt}],
-            options={'temperature': 0}
-        )
-
-        response_text = response['message']['content'].strip()
-
-        # Parse JSON
-        start = response_text.find('{')
-        end = response_text.rfind('}') + 1
-        if start != -1 and end > start:
-            response_text = response_text[start:end]
-
-        extracted = json.loads(response_text)
+        response_text = chat_with_retry(prompt, client)
+        extracted = parse_extraction(response_text)
 
     except Exception as e:
         print(f"  Error: {e}")
@@ -120,36 +282,233 @@ def rowwise_extract(row) -> dict:
             'error': str(e)
         }
 
-    # Add original metadata
-    extracted['project'] = row['project']
-    extracted['organism'] = row['organism']
-    extracted['n_samples'] = row['n_samples']
-    extracted['study_title'] = row['study_title']
+    return add_metadata(extracted, row)
+
+
+def packed_extract(rows: list, client: ollama.Client = None) -> list:
+    """
+    Extract several rows with one request, one keyed JSON slot per study.
+    Studies whose slot is missing or invalid are re-run singly.
+    """
+    with _stats_lock:
+        TOKEN_STATS['llm_studies'] += len(rows)
+    if len(rows) == 1:
+        return [rowwise_extract(rows[0], client)]
+
+    ids = [str(row['project']) for row in rows]
+    studies = '\n\n'.join(
+        f"""    === STUDY {row['project']} ===
+    Title: {row['study_title']}
+    
+    Abstract: {row['study_abstract']}"""
+        for row in rows
+    )
+
+    prompt = f"""
+    Extract entities from each of these {len(rows)} gene expression study abstracts.
+    Treat every study separately - only extract entities from that study's own title and abstract.
+
+    {build_guide(rows)}
+    
+{studies}
+
+    Return ONLY a JSON object with exactly one entry per study ID ({', '.join(ids)}):
+    {{
+        "<study ID>": {{
+            "drugs": ["drug names mentioned"],
+            "genes": ["gene symbols mentioned - NOT techniques"],
+            "cell_types": ["cell types mentioned"],
+            "diseases": ["diseases/conditions mentioned"],
+            "techniques": ["experimental techniques mentioned"],
+            "tissues": ["tissues/organs mentioned"]
+        }}
+    }}
+
+    JSON:"""
+
+    try:
+        result = parse_extraction(chat_with_retry(prompt, client))
+    except Exception as e:
+        print(f"  Packed request error: {e}")
+        result = {}
+    if not isinstance(result, dict):
+        result = {}
+
+    all_extracted = []
+    for project, row in zip(ids, rows):
+        extracted = validate_extraction(result.get(project))
+        if extracted is None:
+            print(f"  Packed slot failed for {project}, re-running singly")
+            with _stats_lock:
+                TOKEN_STATS['slot_failures'] += 1
+            all_extracted.append(rowwise_extract(row, client))
+        else:
+            all_extracted.append(add_metadata(extracted, row))
+    return all_extracted
+
+
+def tagged_extract(rows: list, client: ollama.Client = None) -> list:
+    """
+    Tag rows with the entity dictionary first. Rows with every category
+    covered skip the LLM; the rest are extracted by the LLM and merged with
+    the dictionary hits.
+    """
+    if not DICTIONARY_NER:
+        return packed_extract(rows, client)
+
+    tagger = get_tagger()
+    tagged = [tagger.tag(f"{row['study_title']}\n{row['study_abstract']}") for row in rows]
+    skip = [len(covered) == len(ENTITY_KEYS) for _, covered in tagged]
+    llm_rows = [row for row, skipped in zip(rows, skip) if not skipped]
+    llm_results = iter(packed_extract(llm_rows, client) if llm_rows else [])
+
+    all_extracted = []
+    for row, (entities, _), skipped in zip(rows, tagged, skip):
+        if skipped:
+            with _stats_lock:
+                TOKEN_STATS['ner_skipped'] += 1
+            all_extracted.append(add_metadata({**entities, 'source': 'dictionary'}, row))
+        else:
+            all_extracted.append(merge_entities(next(llm_results), entities))
+    return all_extracted
+
+
+def ner_report() -> str:
+    """
+    Studies the dictionary tagger kept from the LLM and the time saved, from
+    the measured LLM time per study (a packed request covers several studies).
+    """
+    skipped = TOKEN_STATS['ner_skipped']
+    if not skipped:
+        return "Dictionary tagger: no studies skipped the LLM"
+    studies = TOKEN_STATS['llm_studies']
+    per_study = TOKEN_STATS['llm_seconds'] / studies if studies else 7
+    return (f"Dictionary tagger: {skipped} of {skipped + studies} studies skipped the LLM, "
+            f"~{skipped * per_study / 60:.1f} min saved ({per_study:.1f}s per study)")
+
+
+def iter_packs(rows, pack_size: int):
+    """Group (idx, row) pairs into lists of rows."""
+    pack = []
+    for _, row in rows:
+        pack.append(row)
+        if len(pack) >= pack_size:
+            yield pack
+            pack = []
+    if pack:
+        yield pack
+
+
+def extract_rows(rows, workers: int = 1, pack_size: int = PACK_SIZE):
+    """
+    Yield (row, extracted) in input order.
+    Each request carries up to `pack_size` studies; with workers > 1
+    up to `workers` requests are in flight at once.
+    """
+    packs = iter_packs(rows, max(pack_size, 1))
+
+    if workers <= 1:
+        for pack in packs:
+            yield from zip(pack, tagged_extract(pack))
+        return
+
+    client = get_client()
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for pack in packs:
+                pending.append((pack, executor.submit(tagged_extract, pack, client)))
+                # Bound in-flight work, collecting results in submission order
+                if len(pending) >= workers * 2:
+                    done_pack, future = pending.popleft()
+                    yield from zip(done_pack, future.result())
+            while pending:
+                done_pack, future = pending.popleft()
+                yield from zip(done_pack, future.result())
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def format_rate(done: int, total: int, elapsed: float) -> str:
+    """Throughput and ETA from the measured rate."""
+    rate = done / elapsed if elapsed > 0 else 0
+    eta = (total - done) / rate if rate > 0 else 0
+    return f"{rate * 60:.1f}/min, ETA {eta / 60:.0f} min"
+
+
+def content_hash(row) -> str:
+    """Hash of the extraction inputs of a row: title, abstract and prompt version."""
+    text = f"{PROMPT_VERSION}\x00{row['study_title']}\x00{row['study_abstract']}"
+    return hashlib.sha256(text.encode(ENCODING)).hexdigest()
+
+
+def load_manifest() -> dict:
+    """Load the project -> content hash manifest, or None if there is none."""
+    if not os.path.exists(MANIFEST_FILE):
+        return None
+    with open(MANIFEST_FILE, 'r', encoding=ENCODING) as f:
+        return json.load(f)
+
+
+def write_manifest(df: pd.DataFrame, projects) -> None:
+    """Record content hashes for the given projects."""
+    projects = set(projects)
+    manifest = {row['project']: content_hash(row) for _, row in df.iterrows() if row['project'] in projects}
+    atomic_write_json(MANIFEST_FILE, manifest)
+
+
+def shard_of(project: str, num_shards: int) -> int:
+    """Deterministic shard of a project ID (stable across processes and machines)."""
+    digest = hashlib.md5(str(project).encode(ENCODING)).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+
+def shard_progress_file(shard_idx: int, num_shards: int) -> str:
+    root, ext = os.path.splitext(PROGRESS_FILE)
+    return f"{root}.shard{shard_idx}of{num_shards}{ext}"
 
-    return extracted
+
+def open_checkpoint(shard: tuple = None) -> JsonlCheckpoint:
+    """Open the JSONL progress checkpoint, importing an old JSON progress file once."""
+    if shard is not None:
+        return JsonlCheckpoint(shard_progress_file(*shard), key='project', fsync_every=BATCH_SIZE)
+
+    checkpoint = JsonlCheckpoint(PROGRESS_FILE, key='project', fsync_every=BATCH_SIZE)
+    if not checkpoint.exists() and os.path.exists(LEGACY_PROGRESS_FILE):
+        print(f"Converting {LEGACY_PROGRESS_FILE} to {PROGRESS_FILE}...")
+        with open(LEGACY_PROGRESS_FILE, 'r') as f:
+            legacy = json.load(f)
+        with checkpoint:
+            for record in legacy:
+                checkpoint.append(record)
+        os.remove(LEGACY_PROGRESS_FILE)
+    return checkpoint
 
 
 # Indexing function
-def index_abstracts(start_idx: int = None, end_idx: int = None, chunk: int = None):
+def index_abstracts(start_idx: int = None, end_idx: int = None, chunk: int = None,
+                    workers: int = WORKERS, pack_size: int = PACK_SIZE, shard: tuple = None):
     """
     Process abstracts and save extracted data.
+    With shard=(i, n) only projects hashing to shard i are processed, into
+    their own checkpoint; run merge_shards afterwards.
     """
 
     # Load data
     print(f"Loading {INPUT_FILE}...")
     df = pd.read_csv(INPUT_FILE, encoding= ENCODING)
+    if shard is not None:
+        df = df[df['project'].map(lambda p: shard_of(p, shard[1])) == shard[0]]
+        print(f"Shard {shard[0]} of {shard[1]} (host: {OLLAMA_HOST or 'default'})")
     total_rows = len(df)
     print(f"Total entries: {total_rows}\n")
 
-    # Load existing progress
-    all_extracted = []
-    processed_ids = set()
-
-    if os.path.exists(PROGRESS_FILE):
-        with open(PROGRESS_FILE, 'r') as f:
-            all_extracted = json.load(f)
-            processed_ids = {item['project'] for item in all_extracted}
-        print(f"Already processed: {len(all_extracted)}")
+    # Load existing progress (resume index of processed project IDs)
+    checkpoint = open_checkpoint(shard)
+    processed_ids = checkpoint.ids()
+    if processed_ids:
+        print(f"Already processed: {len(processed_ids)}")
 
     # Determine range to process
     if start_idx is not None and end_idx is not None:
@@ -170,87 +529,301 @@ def index_abstracts(start_idx: int = None, end_idx: int = None, chunk: int = Non
 
     if remaining == 0:
         print("\nAll entries processed!")
+        if shard is not None:
+            print(f"Shard complete in {checkpoint.path}. Run merge once all shards are done.")
+            return checkpoint.records()
         # Save final file
-        with open(OUTPUT_FILE, 'w') as f:
-            json.dump(all_extracted, f, indent=2, ensure_ascii=False)
+        all_extracted = checkpoint.compact(OUTPUT_FILE)
+        write_manifest(df, processed_ids)
         print(f"Saved to {OUTPUT_FILE}")
         return all_extracted
 
     # Time estimate
-    est_seconds = remaining * 7 # estimating 7 seconds per abstract
+    est_seconds = remaining * 7 / max(workers, 1) # estimating 7 seconds per abstract
     est_minutes = est_seconds / 60
     est_hours = est_minutes / 60
     current_datetime = datetime.datetime.now()
 
-    print(f"\nTo process: {remaining} entries")
+    print(f"\nTo process: {remaining} entries ({workers} workers)")
     print(f"Estimated time: {est_minutes:.0f} min ({est_hours:.1f} hours)")
     print(f"Run start: {current_datetime})")
     print("\nStarting... (Ctrl+C to pause and save)\n")
 
     start_time = time.time()
     processed_this_run = 0
+    failed_ids = set()  # Errors this run: kept in the output, retried by the next run or update
+
+    # Skip if already done
+    rows = ((idx, row) for idx, row in df_to_process.iterrows() if row['project'] not in processed_ids)
 
     try:
-        for idx, row in df_to_process.iterrows():
-            # Skip if already done
-            if row['project'] in processed_ids:
-                continue
+        for row, extracted in extract_rows(rows, workers, pack_size):
+            # Appended records are fsynced every BATCH_SIZE rows
+            checkpoint.append(extracted)
+            if 'error' in extracted:
+                failed_ids.add(row['project'])
+            else:
+                processed_ids.add(row['project'])
+            processed_this_run += 1
 
             # Progress display
-            progress = len(all_extracted) + 1
-            print(f"[{progress}/{total_rows}] {row['project']}: {str(row.get('study_title', ''))[:50]}...")
-
-            # Extract
-            extracted = rowwise_extract(row)
-            all_extracted.append(extracted)
-            processed_ids.add(row['project'])
-            processed_this_run += 1
+            elapsed = time.time() - start_time
+            print(f"[{len(processed_ids)}/{total_rows}] {row['project']}: {str(row.get('study_title', ''))[:50]}... "
+                  f"({format_rate(processed_this_run, remaining, elapsed)})")
 
-            # Save progress
             if processed_this_run % BATCH_SIZE == 0:
-                with open(PROGRESS_FILE, 'w') as f:
-                    json.dump(all_extracted, f, ensure_ascii=False)
-
-                elapsed = time.time() - start_time
-                rate = processed_this_run / elapsed if elapsed > 0 else 0
-                remaining_count = remaining - processed_this_run
-                eta = remaining_count / rate if rate > 0 else 0
-
-                print(f"  → Saved. ETA: {eta / 60:.0f} min\n")
-
-                time.sleep(0.1)
+                print(f"  → Saved. {format_rate(processed_this_run, remaining, elapsed)}\n")
 
     except KeyboardInterrupt:
         print("\n\nPaused! Saving progress...")
-        with open(PROGRESS_FILE, 'w') as f:
-            json.dump(all_extracted, f, ensure_ascii=False)
-        print(f"Progress saved: {len(all_extracted)} total ({processed_this_run} this run)")
+        checkpoint.close()
+        print(f"Progress saved: {len(processed_ids)} total ({processed_this_run} this run)")
         print("Run again to resume.")
-        return all_extracted
+        return checkpoint.records()
 
     # Save final
     print("\nChunk complete! Saving...")
-
-    with open(PROGRESS_FILE, 'w') as f:
-        json.dump(all_extracted, f, ensure_ascii=False)
-
-    # If all complete, save to final file
-    if len(all_extracted) >= total_rows:
-        with open(OUTPUT_FILE, 'w') as f:
-            json.dump(all_extracted, f, indent=2, ensure_ascii=False)
-        if os.path.exists(PROGRESS_FILE):
-            os.remove(PROGRESS_FILE)
-        print(f"All done! Saved to {OUTPUT_FILE}")
+    checkpoint.close()
+
+    # If all complete, compact the checkpoint into the final file. Failed
+    # projects get no manifest entry, so update_index extracts them again.
+    if shard is not None and len(processed_ids | failed_ids) >= total_rows:
+        all_extracted = checkpoint.records()
+        print(f"Shard complete in {checkpoint.path}. Run merge once all shards are done.")
+    elif len(processed_ids | failed_ids) >= total_rows:
+        all_extracted = checkpoint.compact(OUTPUT_FILE)
+        write_manifest(df, processed_ids)
+        checkpoint.remove()
+        print(f"All done! Saved to {OUTPUT_FILE}" +
+              (f" ({len(failed_ids)} failed, retried by the next update)" if failed_ids else ""))
     else:
-        print(f"Progress saved: {len(all_extracted)}/{total_rows}")
+        all_extracted = checkpoint.records()
+        print(f"Progress saved: {len(processed_ids)}/{total_rows}")
         print(f"Run again to continue.")
 
     elapsed = time.time() - start_time
     print(f"\nProcessed: {processed_this_run} entries in {elapsed / 60:.1f} min")
+    print(ner_report())
     print(f"Ended at: {current_datetime})")
 
     return all_extracted
 
+
+def merge_shards(num_shards: int):
+    """
+    Merge shard checkpoints into OUTPUT_FILE.
+    Checks every shard checkpoint exists, every project landed in its own
+    shard and no project is missing, then de-duplicates (a clean record beats
+    one with an error).
+    """
+    checkpoints = [JsonlCheckpoint(shard_progress_file(i, num_shards), key='project') for i in range(num_shards)]
+    absent = [(i, checkpoint.path) for i, checkpoint in enumerate(checkpoints) if not checkpoint.exists()]
+    if absent:
+        print(f"Missing {len(absent)} of {num_shards} shard checkpoints:")
+        for shard_idx, path in absent:
+            print(f"  Shard {shard_idx}: {path}")
+        print("Not writing output. Run the missing shards (same -num-shards), then merge again.")
+        return None
+
+    print(f"Loading {INPUT_FILE}...")
+    df = pd.read_csv(INPUT_FILE, encoding=ENCODING)
+    expected = list(dict.fromkeys(df['project']))
+
+    merged = {}
+    misplaced = 0
+    for shard_idx, checkpoint in enumerate(checkpoints):
+        records = checkpoint.records()
+        print(f"  Shard {shard_idx}: {len(records)} records")
+        for record in records:
+            project = record.get('project')
+            if shard_of(project, num_shards) != shard_idx:
+                misplaced += 1
+            previous = merged.get(project)
+            if previous is None or 'error' in previous or 'error' not in record:
+                merged[project] = record
+
+    missing = [p for p in expected if p not in merged]
+    errors = sum(1 for record in merged.values() if 'error' in record)
+    print(f"\nMerged {len(merged)} unique projects ({misplaced} in the wrong shard, {errors} with errors)")
+
+    if missing:
+        by_shard = Counter(shard_of(p, num_shards) for p in missing)
+        print(f"Missing {len(missing)} projects: " +
+              ', '.join(f"shard {i}: {n}" for i, n in sorted(by_shard.items())))
+        print("Not writing output. Re-run the incomplete shards, then merge again.")
+        return None
+
+    all_extracted = [merged[p] for p in expected]
+    atomic_write_json(OUTPUT_FILE, all_extracted, indent=2)
+    write_manifest(df, [p for p in expected if 'error' not in merged[p]])  # Failed ones are retried by update
+    print(f"Saved {len(all_extracted)} studies to {OUTPUT_FILE}")
+    return all_extracted
+
+
+def update_index(workers: int = WORKERS, pack_size: int = PACK_SIZE, remap: bool = True):
+    """
+    Incrementally refresh OUTPUT_FILE after a new full_dataset.csv.
+    Only new or changed rows (by content hash) are re-extracted, removed
+    projects are tombstoned, and mapping is re-run for the affected studies.
+    """
+    if not os.path.exists(OUTPUT_FILE):
+        print(f"{OUTPUT_FILE} not found. Run full indexing first.")
+        return None
+
+    print(f"Loading {INPUT_FILE}...")
+    df = pd.read_csv(INPUT_FILE, encoding=ENCODING)
+    current = {row['project']: content_hash(row) for _, row in df.iterrows()}
+
+    with open(OUTPUT_FILE, 'r', encoding=ENCODING) as f:
+        existing = {record['project']: record for record in json.load(f)}
+
+    manifest = load_manifest()
+    if manifest is None:
+        print("No manifest found - assuming the existing output matches the current CSV")
+        manifest = {p: h for p, h in current.items() if p in existing and 'error' not in existing[p]}
+
+    new = [p for p in current if p not in manifest]
+    changed = [p for p in current if p in manifest and manifest[p] != current[p]]
+    removed = [p for p in {**manifest, **existing} if p not in current]
+
+    # Resume an interrupted update
+    checkpoint = JsonlCheckpoint(UPDATE_PROGRESS_FILE, key='project', fsync_every=BATCH_SIZE)
+    done = checkpoint.latest()
+    todo = {p for p in new + changed if done.get(p, {}).get('_hash') != current[p]}
+
+    print(f"New: {len(new)}, changed: {len(changed)}, removed: {len(removed)}")
+    print(f"To extract: {len(todo)} ({len(new) + len(changed) - len(todo)} already done)\n")
+
+    start_time = time.time()
+    processed_this_run = 0
+    rows = ((idx, row) for idx, row in df[df['project'].isin(todo)].iterrows())
+
+    try:
+        for row, extracted in extract_rows(rows, workers, pack_size):
+            # A failed extraction gets no hash, so a resumed update retries it
+            checkpoint.append(extracted if 'error' in extracted else {**extracted, '_hash': current[row['project']]})
+            processed_this_run += 1
+            elapsed = time.time() - start_time
+            print(f"[{processed_this_run}/{len(todo)}] {row['project']}: {str(row.get('study_title', ''))[:50]}... "
+                  f"({format_rate(processed_this_run, len(todo), elapsed)})")
+
+        for project in removed:
+            if not done.get(project, {}).get('_deleted'):
+                checkpoint.append({'project': project, '_deleted': True})
+
+    except KeyboardInterrupt:
+        checkpoint.close()
+        print(f"\n\nPaused! {processed_this_run} re-extracted this run. Run update again to resume.")
+        return None
+
+    checkpoint.close()
+
+    # Merge updates into the existing output
+    updated, deleted = [], []
+    for project, record in checkpoint.latest().items():
+        if record.get('_deleted'):
+            existing.pop(project, None)
+            deleted.append(project)
+        else:
+            record.pop('_hash', None)
+            existing[project] = record
+            updated.append(project)
+
+    all_extracted = list(existing.values())
+    atomic_write_json(OUTPUT_FILE, all_extracted, indent=2)
+    # Projects whose extraction failed stay out of the manifest, so the next update retries them
+    atomic_write_json(MANIFEST_FILE, {p: current[p] for p, record in existing.items()
+                                      if p in current and 'error' not in record})
+    affected = {'updated': updated, 'removed': deleted}
+    atomic_write_json(AFFECTED_FILE, affected, indent=2)
+    checkpoint.remove()
+    print(f"\nUpdated {len(updated)}, removed {len(deleted)}. Saved to {OUTPUT_FILE}")
+    print(ner_report())
+
+    if remap and (updated or deleted):
+        from src.data_mapping import update_mapped
+        update_mapped(affected)
+
+    return all_extracted
+
+
+def entity_agreement(a: dict, b: dict) -> float:
+    """Jaccard similarity of all extracted entities of two results."""
+    set_a = {(k, str(v).lower()) for k in ENTITY_KEYS for v in a.get(k) or []}
+    set_b = {(k, str(v).lower()) for k in ENTITY_KEYS for v in b.get(k) or []}
+    if not set_a and not set_b:
+        return 1.0
+    return len(set_a & set_b) / len(set_a | set_b)
+
+
+def tag_precision(sample: pd.DataFrame, baseline: dict) -> dict:
+    """
+    Share of dictionary tags that the baseline LLM extraction also found, per
+    category and overall ('all'), as {key: (precision, number of tags)}.
+    """
+    tagger = get_tagger()
+    hits, totals = Counter(), Counter()
+    for _, row in sample.iterrows():
+        entities, _ = tagger.tag(f"{row['study_title']}\n{row['study_abstract']}")
+        expected = baseline.get(row['project'], {})
+        for key in ENTITY_KEYS:
+            found = {str(v).lower() for v in expected.get(key) or []}
+            for value in entities[key]:
+                totals[key] += 1
+                hits[key] += value.lower() in found
+    totals['all'], hits['all'] = sum(totals.values()), sum(hits.values())
+    return {key: (hits[key] / totals[key] if totals[key] else 1.0, totals[key]) for key in (*ENTITY_KEYS, 'all')}
+
+
+def benchmark(sample_size: int = 20, pack_sizes: tuple = (1, PACK_SIZE), workers: int = WORKERS):
+    """
+    Run extraction on a fixed sample with the full and the pruned reference
+    for each pack size, with and without the dictionary tagger, and report
+    cost per study plus entity agreement with the baseline
+    (pack 1, full reference, LLM only), then the precision of the dictionary
+    tags against the baseline.
+    Nothing is written to the progress or output files.
+    """
+    global PRUNE_REFERENCE, DICTIONARY_NER
+    settings = PRUNE_REFERENCE, DICTIONARY_NER
+
+    df = pd.read_csv(INPUT_FILE, encoding=ENCODING)
+    sample = df.sample(n=min(sample_size, len(df)), random_state=0)
+    n = len(sample)
+    print(f"Benchmarking {n} studies, workers={workers}\n")
+
+    configs = [(1, False, False)]
+    configs += [(pack_size, prune, True) for pack_size in dict.fromkeys((1, *pack_sizes))
+                for prune in (False, True)]
+
+    print(f"{'pack':>5} {'pruned':>7} {'ner':>6} {'requests':>9} {'prompt tok/study':>17} "
+          f"{'output tok/study':>17} {'sec/study':>10} {'slot failures':>14} {'ner skipped':>12} {'agreement':>10}")
+    baseline = None
+    try:
+        for pack_size, prune, ner in configs:
+            PRUNE_REFERENCE, DICTIONARY_NER = prune, ner
+            TOKEN_STATS.clear()
+            start_time = time.time()
+            results = {row['project']: extracted
+                       for row, extracted in extract_rows(sample.iterrows(), workers, pack_size)}
+            elapsed = time.time() - start_time
+
+            if baseline is None:
+                baseline = results
+            agreement = sum(entity_agreement(results[p], baseline[p]) for p in results) / n
+
+            print(f"{pack_size:>5} {str(prune):>7} {str(ner):>6} {TOKEN_STATS['requests']:>9} "
+                  f"{TOKEN_STATS['prompt_tokens'] / n:>17.0f} {TOKEN_STATS['eval_tokens'] / n:>17.0f} "
+                  f"{elapsed / n:>10.2f} {TOKEN_STATS['slot_failures']:>14} {TOKEN_STATS['ner_skipped']:>12} "
+                  f"{agreement:>10.2f}")
+    finally:
+        PRUNE_REFERENCE, DICTIONARY_NER = settings
+
+    print(f"\nDictionary tag precision vs baseline:")
+    for key, (precision, tags) in tag_precision(sample, baseline).items():
+        print(f"{key:>12} {precision:>6.2f} ({tags} tags)")
+
+
 def show_summary():
     """
     Show progress summary of extracted data.
@@ -316,15 +889,43 @@ if __name__ == "__main__":
     parser.add_argument("-chunk", type=int, help="Process only N entries")
     parser.add_argument("-start", type=int, help="Start index")
     parser.add_argument("-end", type=int, help="End index")
+    parser.add_argument("-workers", type=int, default=WORKERS, help="Concurrent extraction requests")
+    parser.add_argument("-pack", type=int, default=PACK_SIZE, help="Abstracts per request")
+    parser.add_argument("-sample", type=int, default=20, help="Benchmark sample size")
+    parser.add_argument("-full-reference", action="store_true", help="List every known abbreviation in prompts")
+    parser.add_argument("-ner", action="store_true",
+                        help="Tag entities with the dictionary first, skip the LLM for fully covered abstracts")
+    parser.add_argument("-shard", type=int, help="Process only this shard (0-based)")
+    parser.add_argument("-num-shards", type=int, default=1, help="Total number of shards")
+    parser.add_argument("-host", help="Ollama endpoint for this worker, e.g. http://127.0.0.1:11435")
     parser.add_argument("mode", nargs="?", default="run")
 
     args = parser.parse_args()
+    if args.num_shards < 1:
+        parser.error("-num-shards must be at least 1")
+    if args.shard is not None and not 0 <= args.shard < args.num_shards:
+        parser.error(f"-shard must be between 0 and {args.num_shards - 1} (-num-shards {args.num_shards})")
+    if args.full_reference:
+        PRUNE_REFERENCE = False
+    if args.ner:
+        DICTIONARY_NER = True
+    if args.host:
+        OLLAMA_HOST = args.host
 
     if len(sys.argv) > 1 and sys.argv[1] == 'summary':
         show_summary()
+    elif args.mode == 'merge':
+        merge_shards(args.num_shards)
+    elif args.mode == 'update':
+        update_index(workers=args.workers, pack_size=args.pack)
+    elif args.mode == 'benchmark':
+        benchmark(sample_size=args.sample, pack_sizes=(1, args.pack), workers=args.workers)
     else:
         index_abstracts(
             start_idx=args.start,
             end_idx=args.end,
-            chunk=args.chunk
+            chunk=args.chunk,
+            workers=args.workers,
+            pack_size=args.pack,
+            shard=(args.shard, args.num_shards) if args.shard is not None else None
         )
\ No newline at end of file
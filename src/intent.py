@@ -3,21 +3,95 @@
 Intent detection and ambiguity checking.
 """
 
+import json
+import os
+from src.config import INTENT_LOG_FILE, ENCODING
+from src.intent_classifier import IntentClassifier
 from src.utils import call_llm, parse_json_response
 
+# Labelled examples shared by the LLM prompt and the local classifier
+SEARCH_EXAMPLES = [
+    "breast cancer studies", "find tamoxifen data", "show me melanoma", "SRP123456"
+]
+ANALYZE_EXAMPLES = [
+    "what drugs are most common?", "summarize techniques", "how many studies?", "top genes",
+    "count diseases", "what are the most frequently used",
+    "what are the most commonly used drugs for breast cancer",
+    "what are the most commonly used drugs for PDAC treatment"
+]
+
+# Further labelled queries from the other prompts and the sidebar examples
+EXTRA_SEARCH_EXAMPLES = [
+    "shoe mw Keytruda studies", "brest cancer", "show me BRCA studies", "human melanoma",
+    "studies with tamoxifen", "breast cancer studies using trastuzumab",
+    "show me human melanoma studies", "ovarian cancer", "scRNA-seq"
+]
+EXTRA_ANALYZE_EXAMPLES = [
+    "Top genes in human lung cancer", "How many studies mention CRC?",
+    "summarize the techniques in this database",
+    "what are the most commonly used drugs for breast cancer treatment?"
+]
+
+# Typical phrasings of both intents, so the classifier starts with broad centroids
+SEED_SEARCH_EXAMPLES = [
+    "lung cancer studies", "find glioblastoma datasets", "studies using doxorubicin", "show me colon cancer data",
+    "liver cancer RNA-seq", "Parkinson's disease brain samples", "KRAS mutant studies", "BRAF inhibitor datasets",
+    "single cell data for B cells", "find datasets on hepatitis", "show ovarian cancer studies",
+    "studies on neurons and astrocytes", "mouse kidney studies", "lymphoma datasets", "find CUT&RUN studies",
+    "SRP012345", "GSE98765", "datasets with nivolumab", "look for heart tissue samples", "obesity studies in adipose",
+    "show me studies about MYC", "melanoma with vemurafenib", "get me COPD datasets", "Crohn's disease",
+    "find influenza infection studies", "stroke RNA-seq data", "studies on NK cells in lung cancer",
+    "I need sarcoma data", "medulloblastoma", "studies with interferon treatment", "find me thyroid cancer",
+    "autism brain tissue", "search for psoriasis", "any studies on osteoarthritis?", "head and neck cancer datasets",
+    "studies with rapamycin", "find skin datasets", "cervical cancer", "show me bulk RNA-seq of blood",
+    "PRJNA123456", "fibroblast datasets", "data for hematopoietic stem cells", "studies of aging muscle",
+]
+SEED_ANALYZE_EXAMPLES = [
+    "which drugs are used most?", "what is the distribution of diseases", "which techniques are studied the most",
+    "give me an overview of the studies", "what percentage of studies are human",
+    "which genes appear most in breast cancer studies", "list the most popular drugs", "what cell types are represented",
+    "compare lung and breast cancer studies", "which tissues are most common in melanoma",
+    "what's the breakdown of techniques", "statistics on genes in colon cancer", "which drugs are used for lymphoma",
+    "what is the median number of samples", "rank drugs by number of studies", "what fraction of studies use ATAC-seq",
+    "which tissues are studied in Alzheimer's disease", "describe the database", "what kinds of cells are there",
+    "distribution of organisms", "which drugs co-occur with tamoxifen", "give me stats on diseases",
+    "which techniques are included", "what tissues have the most studies", "overview of drug classes",
+    "what is the proportion of single cell studies", "which diseases are associated with TP53",
+    "list diseases by frequency", "what are the common tissues", "which genes are most studied",
+]
+
+# Below this classifier confidence the LLM decides the intent (tuned on held-out
+# phrasings: no misclassification above it, about 70% of the queries covered)
+INTENT_CONFIDENCE_THRESHOLD = 0.8
+
+# The classifier only learns from labels it can trust: keyword matches, LLM
+# answers that agree with what it already predicted at least this confidently,
+# and LLM answers repeated for the same query, which can also correct it
+TRUSTED_SOURCES = ('keyword', 'llm_agreed', 'llm_consistent')
+LLM_AGREEMENT_CONFIDENCE = 0.6
+LLM_CONSISTENT_VOTES = 2  # Turns in a row the LLM must give a query the same label
+RECALIBRATE_EVERY = 20  # Refit the confidence calibration after this many learned examples
+MAX_LOG_EXAMPLES = 2000  # Most recent unique queries kept in the intent log
+
+_classifier = None
+_logged = None  # Normalized query -> its latest intent log entry
+_uncalibrated = 0  # Examples learned since the last calibration
+
 
 def detect_intent(user_query: str) -> dict:
     """Detect if user wants to SEARCH or ANALYZE."""
+    search_examples = ', '.join(f'"{e}"' for e in SEARCH_EXAMPLES)
+    analyze_examples = ', '.join(f'"{e}"' for e in ANALYZE_EXAMPLES)
     prompt = f"""
     Classify this query about gene expression studies.
 
     Query: "{user_query}"
     
     SEARCH queries = Looking for specific studies/datasets
-    Examples: "breast cancer studies", "find tamoxifen data", "show me melanoma", "SRP123456"
+    Examples: {search_examples}
     
     ANALYZE queries = Asking questions ABOUT the database contents (statistics, summaries, counts)
-    Examples: "what drugs are most common?", "summarize techniques", "how many studies?", "top genes", "count diseases", "what are the most frequently used", "what are the most commonly used drugs for breast cancer", "what are the most commonly used drugs for PDAC treatment"
+    Examples: {analyze_examples}
     
     CRITICAL: Questions with "what", "how many", "summarize", "top", "most common", "most commonly used", "count" are ALWAYS ANALYZE queries, 
     even if they mention specific diseases, drugs, or abbreviations.
@@ -31,6 +105,114 @@ def detect_intent(user_query: str) -> dict:
     return result if result else {"intent": "search"}
 
 
+def _query_key(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+def _read_intent_log() -> list:
+    """
+    Logged entries, one per query (the latest wins), at most MAX_LOG_EXAMPLES
+    of them. The file is rewritten when duplicates or old entries were dropped.
+    """
+    global _logged
+    entries, lines = {}, 0
+    if os.path.exists(INTENT_LOG_FILE):
+        with open(INTENT_LOG_FILE, 'r', encoding=ENCODING) as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partially written line
+                if entry.get('intent') in ('search', 'analyze') and entry.get('query'):
+                    key = _query_key(entry['query'])
+                    entries.pop(key, None)  # Re-insert so the order stays by latest use
+                    entries[key] = entry
+    kept = list(entries.values())[-MAX_LOG_EXAMPLES:]
+
+    if lines > len(kept):
+        try:
+            tmp = INTENT_LOG_FILE + '.tmp'
+            with open(tmp, 'w', encoding=ENCODING) as f:
+                f.writelines(json.dumps(entry, ensure_ascii=False) + '\n' for entry in kept)
+            os.replace(tmp, INTENT_LOG_FILE)
+        except OSError as e:
+            print(f"Intent log error: {e}")
+    _logged = {_query_key(entry['query']): entry for entry in kept}
+    return kept
+
+
+def load_intent_log() -> list:
+    """Logged (query, intent) pairs from trusted sources, as training examples."""
+    return [(entry['query'], entry['intent']) for entry in _read_intent_log()
+            if entry.get('source') in TRUSTED_SOURCES]
+
+
+def log_intent(user_query: str, intent: str, source: str) -> None:
+    """
+    Append a labelled query to the intent log. A query is learned once: labels
+    from trusted sources go to the live classifier, which is recalibrated every
+    RECALIBRATE_EVERY of them. An LLM label counts as trusted once the LLM gave
+    the query the same label LLM_CONSISTENT_VOTES times in a row.
+    """
+    global _uncalibrated
+    if intent not in ('search', 'analyze'):
+        return
+    if _logged is None:
+        _read_intent_log()
+    key = _query_key(user_query)
+    previous = _logged.get(key)
+    if previous is not None and previous.get('source') in TRUSTED_SOURCES:
+        return
+
+    entry = {'query': user_query, 'intent': intent, 'source': source}
+    if source == 'llm':
+        repeated = previous is not None and previous['intent'] == intent
+        entry['votes'] = previous.get('votes', 1) + 1 if repeated else 1
+        if entry['votes'] >= LLM_CONSISTENT_VOTES:
+            entry['source'] = 'llm_consistent'
+    _logged[key] = entry
+    try:
+        with open(INTENT_LOG_FILE, 'a', encoding=ENCODING) as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    except OSError as e:
+        print(f"Intent log error: {e}")
+
+    if _classifier is not None and entry['source'] in TRUSTED_SOURCES:
+        _classifier.add_example(user_query, intent)
+        _uncalibrated += 1
+        if _uncalibrated >= RECALIBRATE_EVERY:
+            _classifier.calibrate()
+            _uncalibrated = 0
+
+
+def get_intent_classifier() -> IntentClassifier:
+    """Build the local classifier once from prompt examples plus logged queries."""
+    global _classifier
+    if _classifier is None:
+        examples = [(q, 'search') for q in SEARCH_EXAMPLES + EXTRA_SEARCH_EXAMPLES + SEED_SEARCH_EXAMPLES]
+        examples += [(q, 'analyze') for q in ANALYZE_EXAMPLES + EXTRA_ANALYZE_EXAMPLES + SEED_ANALYZE_EXAMPLES]
+        examples += load_intent_log()
+        _classifier = IntentClassifier(examples)
+    return _classifier
+
+
+def classify_intent(user_query: str) -> dict:
+    """
+    Classify intent locally and only ask the LLM when the classifier is unsure.
+    """
+    intent, confidence = get_intent_classifier().predict(user_query)
+    if confidence >= INTENT_CONFIDENCE_THRESHOLD:
+        return {'intent': intent, 'confidence': confidence, 'source': 'classifier'}
+
+    result = detect_intent(user_query)
+    llm_intent = result.get('intent', 'search')
+    # An LLM label is only learned when it confirms the classifier's own leaning
+    agreed = llm_intent == intent and confidence >= LLM_AGREEMENT_CONFIDENCE
+    log_intent(user_query, llm_intent, 'llm_agreed' if agreed else 'llm')
+    return {'intent': llm_intent, 'confidence': confidence, 'source': 'llm'}
+
+
 def check_ambiguity(user_query: str) -> dict:
     """Check if query is ambiguous and needs clarification."""
     prompt = f"""
@@ -0,0 +1,138 @@
+# intent_classifier.py
+"""
+Local nearest-centroid intent classifier over character n-grams.
+"""
+
+import math
+from collections import Counter
+
+LABELS = ('search', 'analyze')
+NGRAM_SIZES = (2, 3, 4)
+
+
+def char_ngrams(text: str) -> dict:
+    """Return an L2-normalized character n-gram vector for text."""
+    padded = f" {' '.join(text.lower().split())} "
+    counts = Counter()
+    for n in NGRAM_SIZES:
+        for i in range(len(padded) - n + 1):
+            counts[padded[i:i + n]] += 1
+
+    norm = math.sqrt(sum(v * v for v in counts.values()))
+    if norm == 0:
+        return {}
+    return {gram: v / norm for gram, v in counts.items()}
+
+
+def _dot(a: dict, b: dict) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+def _norm(v: dict) -> float:
+    return math.sqrt(sum(x * x for x in v.values()))
+
+
+def _sigmoid(x: float) -> float:
+    if x < -60:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+class IntentClassifier:
+    """
+    Nearest-centroid classifier for "search" vs "analyze" queries.
+
+    Confidence is the Platt-scaled cosine margin between the two centroids,
+    fitted on leave-one-out margins of the training examples.
+    """
+
+    def __init__(self, examples: list):
+        self.sums = {label: Counter() for label in LABELS}
+        self.counts = {label: 0 for label in LABELS}
+        self.vectors = []
+        self.scale, self.bias = 1.0, 0.0
+
+        for query, label in examples:
+            self.add_example(query, label)
+        self.calibrate()
+
+    def add_example(self, query: str, label: str) -> None:
+        """Add one labelled query to its class centroid."""
+        if label not in self.sums:
+            return
+        vec = char_ngrams(query)
+        if not vec:
+            return
+        self.sums[label].update(vec)
+        self.counts[label] += 1
+        self.vectors.append((vec, label))
+
+    def _margin(self, vec: dict, exclude: tuple = None) -> float:
+        """
+        Cosine(analyze centroid) - cosine(search centroid). With exclude=(vec, label)
+        that example is left out of its centroid, computed from dot products
+        instead of a copy of the centroid.
+        """
+        sims = {}
+        for label in LABELS:
+            centroid = self.sums[label]
+            dot = _dot(vec, centroid)
+            if exclude is None:
+                norm_sq = _norm(centroid) ** 2
+            else:
+                norm_sq = self._norms_sq[label]  # Cached by calibrate()
+                if exclude[1] == label:
+                    left_out = exclude[0]
+                    dot -= _dot(vec, left_out)
+                    norm_sq += -2 * _dot(centroid, left_out) + sum(x * x for x in left_out.values())
+            sims[label] = dot / math.sqrt(norm_sq) if norm_sq > 1e-12 else 0.0
+        return sims['analyze'] - sims['search']
+
+    def calibrate(self, iterations: int = 25) -> None:
+        """Fit sigmoid(scale * margin + bias) to leave-one-out margins (Newton's method)."""
+        if not all(self.counts[label] > 1 for label in LABELS):
+            return
+
+        self._norms_sq = {label: _norm(self.sums[label]) ** 2 for label in LABELS}
+        margins = [(self._margin(vec, exclude=(vec, label)), label == 'analyze')
+                   for vec, label in self.vectors]
+
+        # Platt's smoothed targets keep the fit from saturating on small data
+        n_pos = sum(1 for _, is_pos in margins if is_pos)
+        n_neg = len(margins) - n_pos
+        hi, lo = (n_pos + 1) / (n_pos + 2), 1 / (n_neg + 2)
+
+        scale, bias = 1.0, 0.0
+        for _ in range(iterations):
+            g_s = g_b = h_ss = h_sb = h_bb = 0.0
+            for margin, is_pos in margins:
+                p = _sigmoid(scale * margin + bias)
+                err = p - (hi if is_pos else lo)
+                w = max(p * (1 - p), 1e-9)
+                g_s += err * margin
+                g_b += err
+                h_ss += w * margin * margin
+                h_sb += w * margin
+                h_bb += w
+            det = h_ss * h_bb - h_sb * h_sb
+            if abs(det) < 1e-12:
+                break
+            scale -= (h_bb * g_s - h_sb * g_b) / det
+            bias -= (h_ss * g_b - h_sb * g_s) / det
+        self.scale, self.bias = scale, bias
+
+    def predict(self, query: str) -> tuple:
+        """Return (intent, confidence) for a query."""
+        if not all(self.counts[label] for label in LABELS):
+            return 'search', 0.0
+
+        vec = char_ngrams(query)
+        if not vec:
+            return 'search', 0.0
+
+        p_analyze = _sigmoid(self.scale * self._margin(vec) + self.bias)
+        if p_analyze >= 0.5:
+            return 'analyze', p_analyze
+        return 'search', 1.0 - p_analyze
@@ -0,0 +1,379 @@
+# jobs.py
+"""
+Background download and export jobs.
+
+A selection is submitted as a job and downloaded outside the Streamlit script
+thread, so reruns, page switches and closed tabs do not stop it.
+- One JobManager per server process (st.cache_resource) with one shared
+  DownloadEngine and a fixed pool of MAX_WORKERS file workers
+- Files are handed to the pool one at a time, round-robin over owners and
+  first-in first-out over each owner's jobs, so a large job from one user
+  does not hold up a small job from another
+- A job's file sizes are probed (HEAD requests, or the cache) before it is
+  queued, and its files are handed out largest first
+- Jobs are recorded in a sqlite table in JOBS_DIR with their progress and
+  per-file report, and their archives are kept there for JOB_MAX_AGE
+- Jobs left queued or running by a restarted server are started again
+  (finished files come from the cache, partial files resume)
+- Study metadata exports run the same way on a small pool of their own and
+  write their file to JOBS_DIR, so the script thread never builds or holds it
+- Pages poll jobs_for() and exports_for() instead of waiting
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from src.config import JOBS_DIR
+from src.downloader import (DownloadEngine, SPOOL_DIR, by_size, cleanup_spool, format_bytes, progress_stats,
+                            status_report, tasks_for_projects, zip_compression)
+from src.export import FORMATS, export_studies
+from src.url_cache import UrlCache
+
+MAX_WORKERS = 8  # Files downloaded at once, over all jobs
+PROBE_WORKERS = 8  # Concurrent size probes per starting job
+EXPORT_WORKERS = 2  # Exports written at once, over all sessions
+JOB_MAX_AGE = 7 * 24 * 3600  # Seconds finished jobs and their archives are kept
+ACTIVE_STATUSES = ('queued', 'running')
+
+JOB_COLUMNS = ('id', 'owner', 'projects', 'status', 'created', 'finished', 'files_done', 'files_total',
+               'failed', 'bytes_done', 'archive', 'urls_archive', 'missing', 'report')
+EXPORT_COLUMNS = ('id', 'owner', 'projects', 'format', 'with_abstracts', 'with_urls', 'status', 'created',
+                  'finished', 'path', 'error')
+
+
+def write_url_lists(path: str, tasks: list, registry) -> None:
+    """ZIP with one text file of download URLs per project."""
+    urls_by_project = {}
+    for task in tasks:
+        urls_by_project.setdefault(task.project, []).append(task.url)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as urls_zip:
+        for project_id, urls in urls_by_project.items():
+            study = registry.study(project_id)
+            if study is not None:
+                project_name = study.get('project', project_id)
+                safe_title = "".join(c for c in project_name if c.isalnum() or c in (' ', '-', '_'))[:50]
+                txt_filename = f"{safe_title}.txt"
+            else:
+                txt_filename = f"{project_id}.txt"
+            urls_zip.writestr(txt_filename, "\n".join([f"# {project_id}"] + urls))
+
+
+class Job:
+    """In-memory state of a queued or running job."""
+
+    def __init__(self, job_id: str, owner: str, tasks: list, archive: str):
+        self.id = job_id
+        self.owner = owner
+        self.tasks = tasks
+        self.pending = deque(tasks)  # Not yet handed to a worker
+        self.remaining = len(tasks)  # Not yet finished
+        self.status = 'queued'
+        self.cancelled = False
+        self.zip = zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED)
+        self.zip_lock = threading.Lock()  # ZipFile writes are not thread-safe
+
+
+class JobManager:
+    """Runs download jobs on a shared worker pool and records them in a job table."""
+
+    def __init__(self, registry, directory: str = JOBS_DIR, max_workers: int = MAX_WORKERS):
+        self.registry = registry
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, 'jobs.sqlite'), check_same_thread=False, timeout=30)
+        self._db_lock = threading.Lock()
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, owner TEXT, projects TEXT, status TEXT, created REAL, finished REAL,
+                files_done INTEGER, files_total INTEGER, failed INTEGER, bytes_done INTEGER,
+                archive TEXT, urls_archive TEXT, missing TEXT, report TEXT)""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created)")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS exports (
+                id TEXT PRIMARY KEY, owner TEXT, projects TEXT, format TEXT, with_abstracts INTEGER,
+                with_urls INTEGER, status TEXT, created REAL, finished REAL, path TEXT, error TEXT)""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS exports_owner ON exports (owner, created)")
+
+        self.engine = DownloadEngine(max_workers=max_workers, cache=UrlCache())
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download-job')
+        self._export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export-job')
+        self._slots = threading.Semaphore(max_workers)  # Free workers
+        self._work = threading.Condition()  # Guards the queues below
+        self._owners = OrderedDict()  # owner -> deque of Jobs with files not yet handed out
+        self._live = {}  # job id -> Job, while queued or running
+
+        self.cleanup()
+        self._restart_unfinished()
+        threading.Thread(target=self._dispatch, name='download-job-dispatcher', daemon=True).start()
+
+    # Job table
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._db_lock, self._db:
+            return self._db.execute(sql, params).fetchall()
+
+    def _update(self, job_id: str, **fields) -> None:
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    # Public API
+
+    def submit(self, owner: str, projects: list) -> str:
+        """Queue a download of the given projects for owner. Returns the job ID."""
+        job_id = uuid.uuid4().hex[:12]
+        archive = os.path.join(self.directory, f"{job_id}.zip")
+        urls_archive = os.path.join(self.directory, f"{job_id}_urls.zip")
+        self._execute("INSERT INTO jobs (id, owner, projects, status, created, files_done, files_total, failed, "
+                      "bytes_done, archive, urls_archive) VALUES (?, ?, ?, 'queued', ?, 0, 0, 0, 0, ?, ?)",
+                      (job_id, owner, json.dumps(list(projects)), time.time(), archive, urls_archive))
+        self._start(job_id, owner, list(projects), archive, urls_archive)
+        return job_id
+
+    def jobs_for(self, owner: str) -> list:
+        """Jobs of owner, newest first, with live progress for unfinished ones."""
+        rows = self._execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE owner = ? ORDER BY created DESC",
+                             (owner,))
+        jobs = []
+        for row in rows:
+            job = dict(zip(JOB_COLUMNS, row))
+            job['projects'] = json.loads(job['projects'])
+            job['missing'] = json.loads(job['missing'] or '[]')
+            job['report'] = json.loads(job['report'] or '[]')
+            job['bytes_total'] = job['bytes_done']
+            live = self._live.get(job['id'])
+            if live is not None:
+                stats = progress_stats(live.tasks)
+                job.update(status=live.status, files_done=stats['files_done'], files_total=stats['files_total'],
+                           failed=stats['failed'], bytes_done=stats['bytes_done'], bytes_total=stats['bytes_total'],
+                           sizes_known=stats['sizes_known'], active=stats['active'],
+                           report=status_report(live.tasks))
+            jobs.append(job)
+        return jobs
+
+    def submit_export(self, owner: str, projects: list, fmt: str, with_abstracts: bool = False,
+                      with_urls: bool = False) -> str:
+        """Queue an export of the given projects for owner. Returns the export ID."""
+        export_id = uuid.uuid4().hex[:12]
+        path = os.path.join(self.directory, f"{export_id}_export.{FORMATS[fmt][0]}")
+        self._execute("INSERT INTO exports (id, owner, projects, format, with_abstracts, with_urls, status, created, "
+                      "path) VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+                      (export_id, owner, json.dumps(list(projects)), fmt, with_abstracts, with_urls, time.time(), path))
+        self._export_executor.submit(self._export, export_id, list(projects), fmt, with_abstracts, with_urls, path)
+        return export_id
+
+    def exports_for(self, owner: str) -> list:
+        """Exports of owner, newest first."""
+        rows = self._execute(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM exports WHERE owner = ? "
+                             f"ORDER BY created DESC", (owner,))
+        exports = []
+        for row in rows:
+            export = dict(zip(EXPORT_COLUMNS, row))
+            export['projects'] = json.loads(export['projects'])
+            exports.append(export)
+        return exports
+
+    def cache_stats(self) -> dict:
+        """Counters, hit rate and size of the download cache shared by all jobs."""
+        return self.engine.cache.stats()
+
+    def cancel(self, job_id: str) -> None:
+        """Stop handing out files of a job; files already in flight finish first."""
+        with self._work:
+            job = self._live.get(job_id)
+            if job is None:
+                return
+            job.cancelled = True
+            job.remaining -= len(job.pending)
+            job.pending.clear()
+            finished = job.remaining == 0
+        if finished:
+            self._finish(job)
+
+    def remove(self, job_id: str) -> None:
+        """Delete a finished job and its archives."""
+        if job_id in self._live:
+            return
+        rows = self._execute("SELECT archive, urls_archive FROM jobs WHERE id = ?", (job_id,))
+        self._execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        for path in (rows[0] if rows else ()):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    def remove_export(self, export_id: str) -> None:
+        """Delete a finished export and its file."""
+        rows = self._execute("SELECT status, path FROM exports WHERE id = ?", (export_id,))
+        if not rows or rows[0][0] in ACTIVE_STATUSES:
+            return
+        self._execute("DELETE FROM exports WHERE id = ?", (export_id,))
+        if os.path.exists(rows[0][1]):
+            os.remove(rows[0][1])
+
+    def cleanup(self, max_age: float = JOB_MAX_AGE) -> None:
+        """Delete jobs and exports that finished more than max_age seconds ago, and stale spool files."""
+        cutoff = time.time() - max_age
+        for (job_id,) in self._execute("SELECT id FROM jobs WHERE finished IS NOT NULL AND finished < ?",
+                                       (cutoff,)):
+            self.remove(job_id)
+        for (export_id,) in self._execute("SELECT id FROM exports WHERE finished IS NOT NULL AND finished < ?",
+                                          (cutoff,)):
+            self.remove_export(export_id)
+        cleanup_spool()
+
+    # Scheduling
+
+    def _restart_unfinished(self) -> None:
+        """Start jobs and exports again that a previous server process left queued or running."""
+        rows = self._execute("SELECT id, owner, projects, archive, urls_archive FROM jobs "
+                             "WHERE status IN ('queued', 'running') ORDER BY created")
+        for job_id, owner, projects, archive, urls_archive in rows:
+            print(f"Restarting download job {job_id}")
+            self._start(job_id, owner, json.loads(projects), archive, urls_archive)
+        rows = self._execute("SELECT id, projects, format, with_abstracts, with_urls, path FROM exports "
+                             "WHERE status IN ('queued', 'running') ORDER BY created")
+        for export_id, projects, fmt, with_abstracts, with_urls, path in rows:
+            print(f"Restarting export {export_id}")
+            self._export_executor.submit(self._export, export_id, json.loads(projects), fmt, bool(with_abstracts),
+                                         bool(with_urls), path)
+
+    def _start(self, job_id: str, owner: str, projects: list, archive: str, urls_archive: str) -> None:
+        tasks, missing = tasks_for_projects(projects, self.registry)
+        write_url_lists(urls_archive, tasks, self.registry)
+        job = Job(job_id, owner, tasks, archive)
+        self._update(job_id, status='queued', files_total=len(tasks), missing=json.dumps(missing))
+        if not tasks:
+            self._finish(job)
+            return
+        with self._work:
+            self._live[job_id] = job
+        threading.Thread(target=self._queue, args=(job,), name=f'download-job-probe-{job_id}', daemon=True).start()
+
+    def _queue(self, job: Job) -> None:
+        """Probe the sizes of a new job's files, then queue it with its largest files first."""
+        try:
+            with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as probes:
+                list(probes.map(self.engine.probe_size, job.tasks))
+        except Exception as e:  # Unknown sizes only cost the ordering
+            print(f"Download job {job.id}: size probe failed: {e}")
+        with self._work:
+            if job.cancelled:
+                return
+            job.pending = deque(by_size(job.pending))
+            self._owners.setdefault(job.owner, deque()).append(job)
+            self._work.notify()
+
+    def _export(self, export_id: str, projects: list, fmt: str, with_abstracts: bool, with_urls: bool,
+                path: str) -> None:
+        """Write one export file; its rows are streamed from the stores a chunk at a time."""
+        self._execute("UPDATE exports SET status = 'running' WHERE id = ?", (export_id,))
+        started = time.time()
+        try:
+            export_studies(projects, self.registry, fmt, with_abstracts, with_urls, path=path)
+        except Exception as e:  # Record the failure instead of losing it in the worker
+            if os.path.exists(path):
+                os.remove(path)
+            self._execute("UPDATE exports SET status = 'failed', finished = ?, error = ? WHERE id = ?",
+                          (time.time(), str(e), export_id))
+            print(f"Export {export_id} failed: {e}")
+            return
+        self._execute("UPDATE exports SET status = 'done', finished = ? WHERE id = ?", (time.time(), export_id))
+        print(f"Export {export_id} done: {len(projects)} studies as {fmt} in {time.time() - started:.1f}s "
+              f"({format_bytes(os.path.getsize(path))})")
+
+    def _take(self):
+        """Next (job, task): the longest-waiting owner's oldest job with files left, or None."""
+        for owner in list(self._owners):
+            jobs = self._owners[owner]
+            while jobs and not jobs[0].pending:
+                jobs.popleft()
+            if not jobs:
+                del self._owners[owner]
+                continue
+            job = jobs[0]
+            self._owners.move_to_end(owner)
+            job.status = 'running'
+            return job, job.pending.popleft()
+        return None
+
+    def _dispatch(self) -> None:
+        """Hand files to free workers one at a time, so every new file goes to the fairest job."""
+        while True:
+            self._slots.acquire()
+            with self._work:
+                picked = self._take()
+                while picked is None:
+                    self._work.wait()
+                    picked = self._take()
+            self._executor.submit(self._run, *picked)
+
+    def _run(self, job: Job, task) -> None:
+        try:
+            if not job.cancelled:
+                self.engine.fetch(task)
+            if task.error is None and task.path is not None:
+                with job.zip_lock:
+                    job.zip.write(task.path, f"{task.project}/{task.filename}",
+                                  compress_type=zip_compression(task.filename))
+        except Exception as e:  # Keep the worker and the job going
+            task.error, task.status = str(e), 'failed'
+            print(f"Download job {job.id}: {task.project}/{task.filename} failed: {e}")
+        finally:
+            task.discard()
+            task.done = True
+            self._slots.release()
+
+        with self._work:
+            job.remaining -= 1
+            finished = job.remaining == 0
+        if finished:
+            self._finish(job)
+        else:
+            stats = progress_stats(job.tasks)
+            self._update(job.id, status='running', files_done=stats['files_done'], failed=stats['failed'],
+                         bytes_done=stats['bytes_done'])
+
+    def _finish(self, job: Job) -> None:
+        job.zip.close()
+        stats = progress_stats(job.tasks)
+        if job.cancelled:
+            job.status = 'cancelled'
+        elif job.tasks and stats['failed'] == len(job.tasks):
+            job.status = 'failed'
+        else:
+            job.status = 'done'
+        self._update(job.id, status=job.status, finished=time.time(), files_done=stats['files_done'],
+                     failed=stats['failed'], bytes_done=stats['bytes_done'],
+                     report=json.dumps(status_report(job.tasks)))
+        with self._work:
+            self._live.pop(job.id, None)
+        cache = self.cache_stats()
+        print(f"Download job {job.id} {job.status}: {stats['files_done'] - stats['failed']}/{len(job.tasks)} files "
+              f"(cache hit rate {cache['hit_rate']:.0%}, {cache['entries']} files, "
+              f"{format_bytes(cache['total_bytes'])})")
+
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    """The process-wide JobManager (shared by all sessions, survives reruns)."""
+    from src.data_service import get_data_service
+    return JobManager(get_data_service().registry)
+
+
+def current_owner() -> str:
+    """
+    Key the jobs of this browser are filed under. It is kept in the URL
+    (?owner=...), so a reload or a bookmark finds the jobs again.
+    """
+    owner = st.session_state.get('job_owner') or st.query_params.get('owner') or uuid.uuid4().hex
+    st.session_state.job_owner = owner
+    if st.query_params.get('owner') != owner:
+        st.query_params['owner'] = owner
+    return owner
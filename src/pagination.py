@@ -0,0 +1,58 @@
+# pagination.py
+"""
+Server-side pagination of result tables.
+
+Only the visible page is sent to the browser. Selections are kept in
+st.session_state.selected_studies, independently of the page shown.
+"""
+
+import math
+import streamlit as st
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+
+def paginate(df, key: str, reset_on=None, default_size: int = 50) -> tuple:
+    """
+    Render page-size and page controls and return (page_df, state_id).
+    The page goes back to 1 whenever `reset_on` (e.g. the active filters)
+    changes. state_id changes with the page, the page size and every reset,
+    so editor widgets keyed with it never carry edits over to other rows.
+    """
+    size_key, page_key = f"{key}_page_size", f"{key}_page"
+    token_key, resets_key = f"{key}_reset_on", f"{key}_resets"
+    if reset_on is not None and st.session_state.get(token_key) != reset_on:
+        st.session_state[token_key] = reset_on
+        st.session_state[resets_key] = st.session_state.get(resets_key, 0) + 1
+        st.session_state[page_key] = 1
+
+    total = len(df)
+    col1, col2, col3 = st.columns([1, 1, 4], vertical_alignment="bottom")
+    with col1:
+        size = st.selectbox("Rows per page", PAGE_SIZES, index=PAGE_SIZES.index(default_size), key=size_key)
+    n_pages = max(1, math.ceil(total / size))
+    if st.session_state.get(page_key, 1) > n_pages:
+        st.session_state[page_key] = n_pages
+    with col2:
+        page = st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, step=1, key=page_key)
+
+    start = (page - 1) * size
+    end = min(start + size, total)
+    with col3:
+        st.caption(f"Rows {start + 1 if total else 0}–{end} of {total}")
+
+    state_id = f"{st.session_state.get(resets_key, 0)}_{page}_{size}"
+    return df.iloc[start:end], state_id
+
+
+def update_selection(selected: list, page_projects: list, page_selected: list) -> list:
+    """
+    Merge the checkboxes of one page into the full selection: projects on this
+    page follow their checkbox, selections on other pages are kept (in order).
+    """
+    on_page = set(page_projects)
+    chosen = set(page_selected)
+    merged = [p for p in selected if p not in on_page or p in chosen]
+    present = set(merged)
+    merged.extend(p for p in page_selected if p not in present)
+    return merged
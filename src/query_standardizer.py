@@ -5,10 +5,11 @@ Standardize search terms using mappings file or LLM.
 
 import json
 from src.utils import call_llm, parse_json_response
-from src.config import MAPPINGS
+from src.data_service import get_data_service
 
 def standardize_term(term: str, category: str) -> str:
     """Standardize terms using mappings file."""
+    MAPPINGS = get_data_service().mappings
     if not MAPPINGS or category not in MAPPINGS:
         return None
 
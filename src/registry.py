@@ -0,0 +1,72 @@
+# registry.py
+"""
+Project registry: constant-time lookups by project ID across the data sources
+(study record, recount3 URL row, abstract).
+"""
+
+
+def normalize_project(project) -> str:
+    return str(project).strip().upper() if project is not None else ''
+
+
+class ProjectRegistry:
+    """
+    Hash indexes over the studies, the URL table and the abstract store.
+    The URL and abstract sources are given as loaders and indexed on first use,
+    so pages that only look up studies never load them.
+    """
+
+    def __init__(self, studies: list, load_urls=None, load_abstracts=None):
+        self._studies = {}
+        for study in studies:
+            self._studies.setdefault(normalize_project(study.get('project')), study)
+        self._load_urls = load_urls
+        self._load_abstracts = load_abstracts
+        self._url_rows = None
+        self._abstracts = None
+
+    def __len__(self):
+        return len(self._studies)
+
+    def __contains__(self, project):
+        return normalize_project(project) in self._studies
+
+    def ids(self):
+        return self._studies.keys()
+
+    def study(self, project: str):
+        """Study record for a project ID (case-insensitive), or None."""
+        return self._studies.get(normalize_project(project))
+
+    @property
+    def has_urls(self) -> bool:
+        return bool(self._url_index())
+
+    def _url_index(self) -> dict:
+        if self._url_rows is None:
+            url_df = self._load_urls() if self._load_urls else None
+            self._url_rows = {}
+            if url_df is not None:
+                records = url_df.astype(object).where(url_df.notna(), None).to_dict('records')
+                for row in records:
+                    self._url_rows.setdefault(normalize_project(row.get('project')), row)
+        return self._url_rows
+
+    def url_row(self, project: str):
+        """recount3 URL row of a project as a dict (missing values are None), or None."""
+        return self._url_index().get(normalize_project(project))
+
+    def _abstract_store(self):
+        if self._abstracts is None:
+            self._abstracts = (self._load_abstracts() if self._load_abstracts else None) or False
+        return self._abstracts or None
+
+    def abstract(self, project: str):
+        """{'study_title', 'study_abstract'} of a project, or None."""
+        store = self._abstract_store()
+        if store is None:
+            return None
+        record = store.get(project)
+        if record is None and normalize_project(project) != project:
+            record = store.get(normalize_project(project))
+        return record
@@ -3,11 +3,11 @@
 Function for search queries.
 """
 
-from src.config import indexed_data
+from src.data_service import get_data_service
 
 def search_data(parsed: dict) -> list:
     """Search indexed data using parsed query."""
-    results = indexed_data.copy()
+    results = list(get_data_service().studies)
 
     for key in ['drugs', 'genes', 'diseases', 'cell_types', 'techniques', 'tissues']:
         if parsed.get(key) == ['any']:
@@ -0,0 +1,332 @@
+# snapshot.py
+"""
+Versioned binary snapshot of the startup data, opened via mmap.
+
+Layout (native byte order, recorded in the header):
+    8 bytes   magic b'R3SNAP\\0\\0'
+    uint32    format version
+    uint32    reserved
+    uint64    header offset
+    uint64    header length
+    ...       8-byte aligned arrays
+    ...       JSON header: sources, string table, tables and their columns
+
+All strings live in one '\\0'-joined UTF-8 string table with a uint64 array
+of start offsets, so a string is decoded only when a column that uses it is
+read, and a value repeated within a column (organisms, entity names) becomes
+one shared object.
+Tables are stored by column, mostly as uint32 string-ID arrays:
+    str   one string ID per row
+    int   one int64 per row
+    list  row offsets into a flat string-ID array
+    json  one string ID per row pointing at a JSON-encoded value
+A per-row state byte tells missing key / null / value apart.
+
+Build with:
+    python -m src.snapshot
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+MAGIC = b'R3SNAP\0\0'
+FORMAT_VERSION = 2
+PREFIX = struct.Struct('<8sIIQQ')
+ALIGN = 8
+
+MISSING, NULL, VALUE = 0, 1, 2
+ENCODING = 'utf-8'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _column_kind(values: list) -> str:
+    present = [v for v in values if v is not None]
+    if all(isinstance(v, str) for v in present):
+        return 'str'
+    if all(isinstance(v, list) and all(isinstance(x, str) for x in v) for v in present):
+        return 'list'
+    if all(type(v) is int and -2**63 <= v < 2**63 for v in present):
+        return 'int'
+    return 'json'
+
+
+class SnapshotWriter:
+    """Collects tables and writes them as one snapshot file."""
+
+    def __init__(self):
+        self.string_ids = {}
+        self.strings = []
+        self.tables = {}
+        self.arrays = []  # (name, array)
+
+    def _sid(self, text: str) -> int:
+        if '\0' in text:
+            text = text.replace('\0', '')  # The string table is '\0'-separated
+        sid = self.string_ids.get(text)
+        if sid is None:
+            sid = self.string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return sid
+
+    def _add_array(self, name: str, values: array) -> str:
+        self.arrays.append((name, values))
+        return name
+
+    def add_table(self, name: str, rows: list) -> None:
+        """Add a list of flat dicts as a column table."""
+        columns = []
+        keys = list(dict.fromkeys(key for row in rows for key in row))
+        for key in keys:
+            values = [row.get(key) for row in rows]
+            kind = _column_kind(values)
+            state = array('B', (MISSING if key not in row else NULL if row[key] is None else VALUE
+                                for row in rows))
+            prefix = f"{name}/{key}"
+            column = {'name': key, 'kind': kind, 'state': self._add_array(f"{prefix}/state", state)}
+
+            if kind == 'list':
+                offsets, flat = array('I', [0]), array('I')
+                for v in values:
+                    flat.extend(self._sid(x) for x in (v or ()))
+                    offsets.append(len(flat))
+                column['offsets'] = self._add_array(f"{prefix}/offsets", offsets)
+                column['ids'] = self._add_array(f"{prefix}/ids", flat)
+            elif kind == 'int':
+                column['ids'] = self._add_array(f"{prefix}/ids", array('q', (v or 0 for v in values)))
+            else:
+                encode = self._sid if kind == 'str' else lambda v: self._sid(json.dumps(v))
+                ids = array('I', (encode(v) if v is not None else 0 for v in values))
+                column['ids'] = self._add_array(f"{prefix}/ids", ids)
+            columns.append(column)
+
+        self.tables[name] = {'rows': len(rows), 'columns': columns}
+
+    def write(self, path: str, sources: dict = None) -> None:
+        """Write the snapshot atomically."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(b'\0' * PREFIX.size)
+            locations = {}
+
+            def put(name, data):
+                pad = -f.tell() % ALIGN
+                f.write(b'\0' * pad)
+                locations[name] = [f.tell(), len(data)]
+                f.write(data)
+
+            encoded = [text.encode(ENCODING) for text in self.strings]
+            offsets, position = array('Q'), 0
+            for data in encoded:
+                offsets.append(position)
+                position += len(data) + 1
+            offsets.append(position)
+            put('strings', b'\0'.join(encoded))
+            put('string_offsets', offsets.tobytes())
+            for name, values in self.arrays:
+                put(name, values.tobytes())
+
+            header = {
+                'byteorder': sys.byteorder,
+                'built_at': time.time(),
+                'sources': sources or {},
+                'strings': {'count': len(self.strings), 'data': 'strings', 'offsets': 'string_offsets'},
+                'arrays': locations,
+                'tables': self.tables,
+            }
+            header_bytes = json.dumps(header).encode(ENCODING)
+            header_offset = f.tell()
+            f.write(header_bytes)
+            f.seek(0)
+            f.write(PREFIX.pack(MAGIC, FORMAT_VERSION, 0, header_offset, len(header_bytes)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """Read-only, memory-mapped snapshot."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SnapshotError(f"{path} is empty")
+        self._view = memoryview(self._mm)
+
+        magic, version, _, header_offset, header_len = PREFIX.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not a snapshot file")
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f"{path} has format version {version}, expected {FORMAT_VERSION}")
+        self.header = json.loads(bytes(self._view[header_offset:header_offset + header_len]))
+        if self.header['byteorder'] != sys.byteorder:
+            raise SnapshotError(f"{path} was built on a {self.header['byteorder']}-endian machine")
+        self._string_data = self._bytes(self.header['strings']['data'])
+        self._string_offsets = self._bytes(self.header['strings']['offsets']).cast('Q')
+
+    def close(self) -> None:
+        self._string_data.release()
+        self._string_offsets.release()
+        self._view.release()
+        self._mm.close()
+        self._file.close()
+
+    def is_fresh(self) -> bool:
+        """False if any recorded source file that still exists has changed since the build."""
+        for path, (size, mtime_ns) in self.header['sources'].items():
+            if not os.path.exists(path):
+                continue
+            stat = os.stat(path)
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                return False
+        return True
+
+    def has_table(self, name: str) -> bool:
+        return name in self.header['tables']
+
+    def _bytes(self, name: str) -> memoryview:
+        offset, length = self.header['arrays'][name]
+        return self._view[offset:offset + length]
+
+    def _ids(self, name: str) -> memoryview:
+        """Zero-copy uint32 view of an array."""
+        return self._bytes(name).cast('I')
+
+    def string(self, sid: int) -> str:
+        """Decode one string of the string table."""
+        start, end = self._string_offsets[sid], self._string_offsets[sid + 1] - 1
+        return str(self._string_data[start:end], ENCODING)
+
+    def decode(self, ids) -> list:
+        """Decode string IDs; repeated IDs share one string object."""
+        memo = {}
+        return [memo[j] if j in memo else memo.setdefault(j, self.string(j)) for j in ids]
+
+    def column(self, table: str, name: str):
+        """Header entry of a column, or None if the table has no such column."""
+        return next((c for c in self.header['tables'][table]['columns'] if c['name'] == name), None)
+
+    def state(self, column: dict) -> bytes:
+        """Per-row MISSING / NULL / VALUE bytes of a column."""
+        return bytes(self._bytes(column['state']))
+
+    def ids(self, column: dict) -> memoryview:
+        """Zero-copy per-row values of a str/json/int column or flat IDs of a list column."""
+        view = self._bytes(column['ids'])
+        return view.cast('q') if column['kind'] == 'int' else view.cast('I')
+
+    def offsets(self, column: dict) -> memoryview:
+        """Zero-copy row offsets of a list column into its flat IDs."""
+        return self._ids(column['offsets'])
+
+    def values(self, column: dict) -> list:
+        """Decode one column to a list of values (None where null or missing)."""
+        kind = column['kind']
+        if kind == 'list':
+            flat = self.decode(self._ids(column['ids']).tolist())
+            offsets = self._ids(column['offsets']).tolist()
+            values = [flat[a:b] for a, b in zip(offsets, offsets[1:])]
+        elif kind == 'int':
+            values = self._bytes(column['ids']).cast('q').tolist()
+        elif kind == 'str':
+            values = self.decode(self._ids(column['ids']).tolist())
+        else:
+            texts = self.decode(self._ids(column['ids']).tolist())
+            return [json.loads(text) if st == VALUE else None for text, st in zip(texts, self.state(column))]
+
+        state = self.state(column)
+        if state.count(VALUE) != len(state):
+            values = [v if st == VALUE else None for v, st in zip(values, state)]
+        return values
+
+    def table(self, name: str) -> list:
+        """Decode a table to a list of dicts (missing keys stay missing)."""
+        table = self.header['tables'][name]
+        rows = [{} for _ in range(table['rows'])]
+        for column in table['columns']:
+            key = column['name']
+            state = bytes(self._bytes(column['state']))
+            values = self.values(column)
+            if state.count(MISSING) == 0:
+                for row, value in zip(rows, values):
+                    row[key] = value
+            else:
+                for row, st, value in zip(rows, state, values):
+                    if st != MISSING:
+                        row[key] = value
+        return rows
+
+    def columns(self, name: str) -> dict:
+        """Decode a table to {column: [values]}."""
+        return {column['name']: self.values(column) for column in self.header['tables'][name]['columns']}
+
+
+def source_stamp(paths: list) -> dict:
+    """{path: (size, mtime_ns)} of the existing source files."""
+    stamps = {}
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stamps[path] = (stat.st_size, stat.st_mtime_ns)
+    return stamps
+
+
+def open_snapshot(path: str):
+    """Open a snapshot if it exists and is current, else return None."""
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = Snapshot(path)
+    except (SnapshotError, OSError, ValueError) as e:
+        print(f"Ignoring snapshot {path}: {e}")
+        return None
+    if not snapshot.is_fresh():
+        print(f"Ignoring snapshot {path}: source data changed, rebuild with python -m src.snapshot")
+        snapshot.close()
+        return None
+    return snapshot
+
+
+def build_snapshot(path: str = None) -> None:
+    """Build the snapshot from the JSON/CSV sources in config."""
+    from src import config
+    path = path or config.SNAPSHOT_FILE
+
+    writer = SnapshotWriter()
+    sources = [config.INDEXED_FILE, config.MAPPINGS_FILE, config.DATA_URL_FILE]
+
+    start = time.time()
+    studies = config.load_data(use_snapshot=False)
+    writer.add_table('studies', studies)
+    print(f"  studies: {len(studies)}")
+
+    mappings = config.load_mappings(use_snapshot=False)
+    writer.add_table('mappings', [{'category': category, 'raw': raw, 'standard': standard}
+                                  for category, mapping in mappings.items()
+                                  for raw, standard in mapping.items()])
+    print(f"  mappings: {sum(len(m) for m in mappings.values())} terms")
+
+    url_df = config.load_url_df(use_snapshot=False)
+    if url_df is not None:
+        records = url_df.astype(object).where(url_df.notna(), None).to_dict('records')
+        writer.add_table('urls', records)
+        print(f"  urls: {len(records)} rows")
+
+    writer.write(path, source_stamp(sources))
+    print(f"Wrote {path} ({os.path.getsize(path) / 1e6:.1f} MB, {len(writer.strings)} strings) "
+          f"in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    build_snapshot(sys.argv[1] if len(sys.argv) > 1 else None)
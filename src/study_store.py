@@ -0,0 +1,280 @@
+# study_store.py
+"""
+Compact, read-only storage of the indexed studies.
+
+Studies are stored column-wise instead of as one dict per study:
+- project and title as plain lists of strings
+- organism as a small integer code into an interned vocabulary
+- n_samples as an int64 array
+- each entity list (diseases, genes, ...) as int32 IDs into a per-category
+  vocabulary, with row offsets into one flat array per category
+
+StudyView is a dict-like, read-only view of one row (entity lists come back
+as tuples), so existing callers keep using s['project'] or s.get('genes', []).
+
+StudyStore.from_snapshot fills the columns straight from the snapshot's
+string-ID arrays: organisms and entity lists are remapped to per-category IDs
+and only their distinct values are decoded.
+
+Memory benchmark against the list-of-dicts structure:
+    python -m src.study_store [mapped_parsed_data_final.json]
+"""
+
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+ENTITY_KEYS = ('diseases', 'drugs', 'genes', 'techniques', 'tissues', 'cell_types')
+MISSING_SAMPLES = -1  # n_samples sentinel for a missing or non-integer value
+
+
+class Vocabulary:
+    """Interned strings with dense integer IDs."""
+
+    __slots__ = ('ids', 'strings')
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def add(self, text: str) -> int:
+        idx = self.ids.get(text)
+        if idx is None:
+            idx = self.ids[text] = len(self.strings)
+            self.strings.append(sys.intern(text))
+        return idx
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class StudyView(Mapping):
+    """Read-only dict-like view of one study in a StudyStore."""
+
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store: "StudyStore", row: int):
+        self._store = store
+        self._row = row
+
+    def get(self, key, default=None):
+        return self._store.value(self._row, key, default)
+
+    def __getitem__(self, key):
+        value = self._store.value(self._row, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return iter(self._store.keys(self._row))
+
+    def __len__(self):
+        return len(self._store.keys(self._row))
+
+    def __repr__(self):
+        return f"StudyView({self.to_dict()!r})"
+
+    def to_dict(self) -> dict:
+        """Plain dict copy with list-valued entities."""
+        return {k: list(v) if isinstance(v, tuple) else v for k, v in self.items()}
+
+
+_MISSING = object()
+
+
+class StudyStore(Sequence):
+    """Struct-of-arrays storage of studies, indexed like a list of StudyViews."""
+
+    def __init__(self, studies=()):
+        self.projects = []
+        self.titles = []
+        self.organisms = array('H')
+        self.organism_vocab = Vocabulary()
+        self.n_samples = array('q')
+        self.vocab = {key: Vocabulary() for key in ENTITY_KEYS}
+        self.offsets = {key: array('I', [0]) for key in ENTITY_KEYS}
+        self.entity_ids = {key: array('i') for key in ENTITY_KEYS}
+        self.extra = {}  # row -> {key: value} for fields outside the fixed columns
+
+        for study in studies:
+            self._append(study)
+        self.views = tuple(StudyView(self, row) for row in range(len(self.projects)))
+
+    @classmethod
+    def from_snapshot(cls, snapshot, table: str = 'studies') -> "StudyStore":
+        """Build a store from a snapshot table without decoding it to dicts."""
+        from src.snapshot import MISSING, VALUE
+
+        store = cls()
+        rows = snapshot.header['tables'][table]['rows']
+        columns = {column['name']: column for column in snapshot.header['tables'][table]['columns']}
+
+        def texts(key):
+            column = columns.get(key)
+            values = snapshot.values(column) if column is not None else [None] * rows
+            return ['' if v is None else v if isinstance(v, str) else str(v) for v in values]
+
+        store.projects = [sys.intern(p) for p in texts('project')]
+        store.titles = texts('study_title')
+
+        organism = columns.get('organism')
+        if organism is not None and organism['kind'] == 'str':
+            strings, codes = _interned_ids(snapshot, organism)
+            store.organism_vocab.strings = strings
+            store.organism_vocab.ids = {text: i for i, text in enumerate(strings)}
+            store.organisms = array('H', codes.astype(np.uint16).tobytes())
+        else:
+            store.organisms = array('H', (store.organism_vocab.add(o) for o in texts('organism')))
+
+        extra = {}  # Fields outside the fixed columns, then invalid n_samples (as _append orders them)
+        for key, column in columns.items():
+            if key in _COLUMNS:
+                continue
+            for row, (st, value) in enumerate(zip(snapshot.state(column), snapshot.values(column))):
+                if st != MISSING:
+                    extra.setdefault(row, {})[key] = value
+        n_samples = columns.get('n_samples')
+        if n_samples is None:
+            store.n_samples = array('q', [MISSING_SAMPLES]) * rows
+        else:
+            state = snapshot.state(n_samples)
+            values = (snapshot.ids(n_samples).tolist() if n_samples['kind'] == 'int'
+                      else snapshot.values(n_samples))
+            for row, (st, n) in enumerate(zip(state, values)):
+                if st == VALUE and isinstance(n, int) and not isinstance(n, bool) and n >= 0:
+                    store.n_samples.append(n)
+                    continue
+                store.n_samples.append(MISSING_SAMPLES)
+                if st != MISSING:
+                    extra.setdefault(row, {})['n_samples'] = n if st == VALUE else None
+
+        for key in ENTITY_KEYS:
+            column = columns.get(key)
+            if column is None:
+                store.offsets[key] = array('I', [0]) * (rows + 1)
+            elif column['kind'] == 'list':
+                strings, ids = _interned_ids(snapshot, column)
+                vocab = store.vocab[key]
+                vocab.strings = strings
+                vocab.ids = {text: i for i, text in enumerate(strings)}
+                store.entity_ids[key] = array('i', ids.astype(np.int32).tobytes())
+                store.offsets[key] = array('I', snapshot.offsets(column))
+            else:
+                vocab, ids, offsets = store.vocab[key], store.entity_ids[key], store.offsets[key]
+                for values in snapshot.values(column):
+                    ids.extend(vocab.add(str(v)) for v in values or ())
+                    offsets.append(len(ids))
+
+        store.extra = {row: extra[row] for row in sorted(extra)}
+        store.views = tuple(StudyView(store, row) for row in range(rows))
+        return store
+
+    def _append(self, study) -> None:
+        row = len(self.projects)
+        extra = {key: value for key, value in study.items() if key not in _COLUMNS}
+
+        self.projects.append(sys.intern(str(study.get('project') or '')))
+        self.titles.append(study.get('study_title', ''))
+        self.organisms.append(self.organism_vocab.add(str(study.get('organism') or '')))
+        n = study.get('n_samples')
+        if isinstance(n, int) and not isinstance(n, bool) and n >= 0:
+            self.n_samples.append(n)
+        else:
+            self.n_samples.append(MISSING_SAMPLES)
+            if 'n_samples' in study:
+                extra['n_samples'] = n
+        if extra:
+            self.extra[row] = extra
+
+        for key in ENTITY_KEYS:
+            # Missing and null entity lists both read back as empty tuples
+            values = study.get(key) or ()
+            vocab = self.vocab[key]
+            self.entity_ids[key].extend(vocab.add(str(v)) for v in values)
+            self.offsets[key].append(len(self.entity_ids[key]))
+
+    def __len__(self):
+        return len(self.views)
+
+    def __getitem__(self, index):
+        return self.views[index]
+
+    def __iter__(self):
+        return iter(self.views)
+
+    def entities(self, row: int, key: str) -> tuple:
+        strings = self.vocab[key].strings
+        offsets = self.offsets[key]
+        return tuple(strings[i] for i in self.entity_ids[key][offsets[row]:offsets[row + 1]])
+
+    def value(self, row: int, key: str, default=None):
+        if key == 'project':
+            return self.projects[row]
+        if key == 'study_title':
+            return self.titles[row]
+        if key == 'organism':
+            return self.organism_vocab.strings[self.organisms[row]]
+        if key in self.vocab:
+            return self.entities(row, key)
+        if key == 'n_samples' and self.n_samples[row] != MISSING_SAMPLES:
+            return self.n_samples[row]
+        return self.extra.get(row, {}).get(key, default)
+
+    def keys(self, row: int) -> list:
+        keys = ['project', 'study_title', 'organism']
+        if self.n_samples[row] != MISSING_SAMPLES:
+            keys.append('n_samples')
+        keys.extend(ENTITY_KEYS)
+        keys.extend(k for k in self.extra.get(row, ()) if k not in keys)
+        return keys
+
+
+_COLUMNS = {'project', 'study_title', 'organism', 'n_samples', *ENTITY_KEYS}
+
+
+def _interned_ids(snapshot, column: dict) -> tuple:
+    """
+    Distinct strings of a str or list snapshot column and the column's IDs
+    remapped into them. Null and missing str values read as ''.
+    """
+    from src.snapshot import VALUE
+
+    sids = np.frombuffer(snapshot.ids(column), dtype=np.uint32).astype(np.int64)
+    if column['kind'] == 'str':
+        sids[np.frombuffer(snapshot.state(column), dtype=np.uint8) != VALUE] = -1
+    distinct, ids = np.unique(sids, return_inverse=True)
+    strings = [sys.intern(snapshot.string(sid)) if sid >= 0 else '' for sid in distinct.tolist()]
+    return strings, ids
+
+
+def benchmark(path: str) -> None:
+    """Compare traced memory of the list-of-dicts data and of a StudyStore built from it."""
+    import gc
+    import json
+    import tracemalloc
+
+    tracemalloc.start()
+    with open(path, 'r', encoding='utf-8') as f:
+        studies = json.load(f)
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+
+    store = StudyStore(studies)
+    del studies
+    gc.collect()
+    store_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"Studies: {len(store)}")
+    print(f"  list of dicts: {dict_bytes / 1e6:8.1f} MB")
+    print(f"  StudyStore:    {store_bytes / 1e6:8.1f} MB ({store_bytes / dict_bytes:.0%})")
+    for key in ENTITY_KEYS:
+        print(f"    {key}: {len(store.entity_ids[key])} mentions, {len(store.vocab[key])} unique")
+
+
+if __name__ == "__main__":
+    from src.config import INDEXED_FILE
+
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else INDEXED_FILE)
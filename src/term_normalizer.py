@@ -0,0 +1,107 @@
+# term_normalizer.py
+"""
+Collapse spelling variants of raw entity terms before LLM mapping.
+
+Terms that only differ by case, hyphenation, whitespace, plurals or
+"-seq"/"seq"/"sequencing" share a normalization key. Genes keep their case
+(human BRAF vs mouse Braf); every other category is casefolded, and clusters
+whose members were mapped to different targets are not propagated (see
+data_mapping). Optionally, keys that are one edit apart (typos) are clustered
+too. Only one representative per cluster needs to
+be mapped; its result applies to every variant.
+"""
+
+import re
+import unicodedata
+from collections import Counter
+
+FUZZY_MIN_LENGTH = 8  # Shorter keys (CD4/CD8, IL6/IL8) are never fuzzy-matched
+PROTECTED_PREFIX = 2  # Fuzzy edits may not touch the first characters
+
+_DASHES = dict.fromkeys(map(ord, '‐‑‒–—−'), '-')
+_WORD_RE = re.compile(r'[^\W_]+\+*')
+
+
+def _singular(word: str) -> str:
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def normalize_key(term: str, keep_case: bool = False) -> str:
+    """Separator- and plural-insensitive key for a term; also case-insensitive unless keep_case (genes)."""
+    text = unicodedata.normalize('NFKC', term).translate(_DASHES)
+    keys = []
+    for word in _WORD_RE.findall(text):
+        folded = word.casefold()
+        if folded in ('sequencing', 'sequence', 'seq'):
+            keys.append('seq')
+        elif keep_case:
+            keys.append(word)
+        else:
+            keys.append(_singular(folded))
+    # "RNA-seq" / "RNAseq" / "RNA sequencing" all end up as "rnaseq"
+    return ''.join(keys)
+
+
+def _one_edit_apart(a: str, b: str) -> bool:
+    """
+    True if a and b differ by one substitution, insertion, deletion or
+    adjacent transposition, none of it in the first PROTECTED_PREFIX characters
+    (prefixes carry meaning: rnaseq / mrnaseq / scrnaseq).
+    """
+    if a == b or abs(len(a) - len(b)) > 1 or a[:PROTECTED_PREFIX] != b[:PROTECTED_PREFIX]:
+        return False
+    if len(a) == len(b):
+        diffs = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return True
+        return (len(diffs) == 2 and diffs[1] == diffs[0] + 1
+                and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]])
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+def cluster_terms(values: Counter, fuzzy: bool = True, keep_case: bool = False) -> dict:
+    """
+    Group terms into clusters of variants.
+    Returns {representative: [variants]}, the representative being the most
+    frequent variant of its cluster.
+
+    Terms sharing a normalization key (see normalize_key for keep_case)
+    always cluster. With fuzzy=True a key
+    also joins the cluster of a more frequent key one edit away; keys only
+    attach to such seeds, so clusters never chain (a~b, b~c does not pull in c).
+    """
+    by_key = {}
+    for term in values:
+        by_key.setdefault(normalize_key(term, keep_case) or term, []).append(term)
+
+    cluster_of = {}
+    if fuzzy:
+        # Symmetric-delete buckets of seed keys, most frequent keys first
+        buckets = {}
+        ordered = sorted(by_key, key=lambda k: sum(values[t] for t in by_key[k]), reverse=True)
+        for key in ordered:
+            eligible = len(key) >= FUZZY_MIN_LENGTH and not any(c.isdigit() for c in key)
+            deletions = {key, *(key[:i] + key[i + 1:] for i in range(len(key)))} if eligible else ()
+            seed = next((other for d in deletions for other in buckets.get(d, ())
+                         if _one_edit_apart(key, other)), None)
+            if seed is not None:
+                cluster_of[key] = seed
+                continue
+            cluster_of[key] = key
+            for d in deletions:
+                buckets.setdefault(d, []).append(key)
+    else:
+        cluster_of = {key: key for key in by_key}
+
+    clusters = {}
+    for key, terms in by_key.items():
+        clusters.setdefault(cluster_of[key], []).extend(terms)
+
+    return {max(terms, key=lambda t: (values[t], t)): terms for terms in clusters.values()}
@@ -0,0 +1,169 @@
+# url_cache.py
+"""
+On-disk cache of downloaded recount3 files, keyed by URL.
+
+Files live in one directory, indexed by a small sqlite table (URL, size,
+SHA-256, ETag/Last-Modified, last access). Entries younger than FRESH_SECONDS
+are served without contacting recount3; older ones are revalidated with a
+conditional request (If-None-Match / If-Modified-Since). Every hit is checked
+against its recorded size and checksum. The total size is bounded by
+evicting the least recently used entries. Hit/miss counters are persisted.
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from src.config import DOWNLOAD_CACHE_DIR
+
+MAX_BYTES = 20 * 1024 ** 3  # Total cache size before LRU eviction
+FRESH_SECONDS = 24 * 3600  # Served without revalidation for this long
+VERIFY_ON_HIT = True  # Re-hash cached files before serving them
+HASH_CHUNK = 1024 * 1024
+
+STAT_KEYS = ('hits', 'revalidated', 'misses', 'bytes_served', 'bytes_fetched', 'evictions', 'corrupt')
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Hard-link src to dst (instant, no extra space), copying if linking is not possible."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class UrlCache:
+    """Size-bounded LRU file cache with HTTP revalidation metadata."""
+
+    def __init__(self, directory: str = DOWNLOAD_CACHE_DIR, max_bytes: int = MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False,
+                                   timeout=30)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY, filename TEXT, size INTEGER, sha256 TEXT,
+                etag TEXT, last_modified TEXT, validated REAL, last_access REAL)""")
+            self._db.execute("CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER)")
+        self.evict()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def lookup(self, url: str):
+        """Cache entry for url as a dict, or None (entries whose file is gone are dropped)."""
+        with self._lock:
+            row = self._db.execute("SELECT url, filename, size, sha256, etag, last_modified, validated "
+                                   "FROM entries WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(('url', 'filename', 'size', 'sha256', 'etag', 'last_modified', 'validated'), row))
+        entry['path'] = self._path(entry['filename'])
+        if not os.path.exists(entry['path']) or os.path.getsize(entry['path']) != entry['size']:
+            self.remove(url)
+            return None
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry['validated'] < FRESH_SECONDS
+
+    def verify(self, entry: dict) -> bool:
+        """Check the cached file against its checksum; corrupt entries are removed."""
+        if not VERIFY_ON_HIT or file_sha256(entry['path']) == entry['sha256']:
+            return True
+        print(f"Cache entry for {entry['url']} failed its checksum, dropping it")
+        self.remove(entry['url'])
+        self.record('corrupt')
+        return False
+
+    @staticmethod
+    def conditional_headers(entry: dict) -> dict:
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def touch(self, url: str, revalidated: bool = False) -> None:
+        """Mark an entry as used (and as just revalidated)."""
+        now = time.time()
+        with self._lock, self._db:
+            if revalidated:
+                self._db.execute("UPDATE entries SET last_access = ?, validated = ? WHERE url = ?", (now, now, url))
+            else:
+                self._db.execute("UPDATE entries SET last_access = ? WHERE url = ?", (now, url))
+
+    def store(self, url: str, src_path: str, sha256: str, etag: str = None, last_modified: str = None) -> None:
+        """Add a downloaded file (src_path stays in place), then evict down to max_bytes."""
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            return
+        filename = hashlib.sha256(url.encode('utf-8')).hexdigest()[:32] + '_' + url.rstrip('/').split('/')[-1][-60:]
+        link_or_copy(src_path, self._path(filename))
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (url, filename, size, sha256, etag, last_modified, now, now))
+        self.evict()
+
+    def remove(self, url: str) -> None:
+        with self._lock, self._db:
+            row = self._db.execute("SELECT filename FROM entries WHERE url = ?", (url,)).fetchone()
+            self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+        if row and os.path.exists(self._path(row[0])):
+            os.remove(self._path(row[0]))
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self) -> None:
+        """Drop least recently used entries until the cache fits max_bytes."""
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        with self._lock:
+            rows = self._db.execute("SELECT url, size FROM entries ORDER BY last_access").fetchall()
+        for url, size in rows:
+            if excess <= 0:
+                break
+            self.remove(url)
+            self.record('evictions')
+            excess -= size
+
+    def record(self, key: str, amount: int = 1) -> None:
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO stats VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = value + ?",
+                             (key, amount, amount))
+
+    def stats(self) -> dict:
+        """Persistent counters plus hit rate and current size."""
+        with self._lock:
+            values = dict(self._db.execute("SELECT key, value FROM stats").fetchall())
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        stats = {key: values.get(key, 0) for key in STAT_KEYS}
+        served = stats['hits'] + stats['revalidated']
+        requests_total = served + stats['misses']
+        stats['hit_rate'] = served / requests_total if requests_total else 0.0
+        stats['entries'] = entries
+        stats['total_bytes'] = self.total_bytes()
+        return stats